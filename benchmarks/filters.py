@@ -0,0 +1,132 @@
+"""
+This file is part of Ojota.
+
+    Ojota is free software: you can redistribute it and/or modify
+    it under the terms of the GNU LESSER GENERAL PUBLIC LICENSE as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Ojota is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU  Lesser General Public License
+    along with Ojota.  If not, see <http://www.gnu.org/licenses/>.
+
+Compares the compiled filters of Ojota._filter with the previous approach of
+parsing every expression for every row.
+
+    python benchmarks/filters.py [rows]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import random
+import sys
+from timeit import repeat
+
+from ojota import Ojota
+
+
+class Item(Ojota):
+    pass
+
+
+def legacy_test_expression(expression, value, element_data):
+    """The per-row expression parsing used before the filters were
+    compiled."""
+    expression_parts = expression.split('__')
+    if len(expression_parts) == 1:
+        field = expression
+        operation = '='
+    else:
+        field, operation = expression_parts
+
+    r = True
+    try:
+        if operation in ('=', 'exact'):
+            r = element_data[field] == value
+        elif operation == 'iexact':
+            r = str(element_data[field]).lower() == str(value).lower()
+        elif operation == 'contains':
+            r = value in element_data[field]
+        elif operation == 'icontains':
+            r = str(value).lower() in str(element_data[field]).lower()
+        elif operation == 'in':
+            r = element_data[field] in value
+        elif operation == 'gt':
+            r = element_data[field] > value
+        elif operation == 'gte':
+            r = element_data[field] >= value
+        elif operation == 'lt':
+            r = element_data[field] < value
+        elif operation == 'lte':
+            r = element_data[field] <= value
+        elif operation == 'startswith':
+            r = str(element_data[field]).startswith(str(value))
+        elif operation == 'istartswith':
+            r = str(element_data[field]).lower().startswith(
+                str(value).lower())
+        elif operation == 'endswith':
+            r = str(element_data[field]).endswith(str(value))
+        elif operation == 'iendswith':
+            r = str(element_data[field]).lower().endswith(
+                str(value).lower())
+        elif operation == 'range':
+            r = value[0] <= element_data[field] <= value[1]
+        elif operation == 'ne':
+            r = element_data[field] != value
+        else:
+            raise AttributeError(
+                "The operation %s does not exist" % operation)
+    except KeyError:
+        r = False
+    return r
+
+
+def legacy_filter(data, filters):
+    filtrados = []
+    for element_data in data:
+        add = True
+        for expression, value in list(filters.items()):
+            if not legacy_test_expression(expression, value, element_data):
+                add = False
+                break
+        if add:
+            filtrados.append(element_data)
+    return filtrados
+
+
+def make_rows(count):
+    random.seed(0)
+    names = ["Juan", "Pedro", "Maria", "Ana", "Jose", "Lucia"]
+    return [{"pk": str(i), "name": random.choice(names) + str(i),
+             "age": random.randint(0, 99),
+             "price": random.random() * 1000,
+             "country_id": str(random.randint(0, 20))}
+            for i in range(count)]
+
+
+CASES = [
+    {"country_id": "3"},
+    {"age__gte": 30, "age__lt": 40},
+    {"name__istartswith": "ju", "price__range": (100, 500)},
+    {"country_id__in": ("1", "2", "3"), "name__icontains": "AN"},
+]
+
+
+def main(count=200000):
+    rows = make_rows(count)
+    print("%d rows" % count)
+    for filters in CASES:
+        assert legacy_filter(rows, filters) == Item._filter(rows, filters)
+        legacy = min(repeat(lambda: legacy_filter(rows, filters),
+                            number=1, repeat=3))
+        compiled = min(repeat(lambda: Item._filter(rows, filters),
+                              number=1, repeat=3))
+        print("%-60s legacy %.3fs compiled %.3fs (x%.1f)" % (
+            sorted(filters), legacy, compiled, legacy / compiled))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -15,14 +15,21 @@ This file is part of Ojota.
     along with Ojota.  If not, see <http://www.gnu.org/licenses/>.
 """
 from __future__ import absolute_import
+import gc
+import time
+import weakref
 from collections import MutableSequence
 from json import dumps
-from threading import current_thread
+from operator import contains, eq, ge, gt, le, lt, ne
+from threading import Event, Lock, current_thread
+from types import MemberDescriptorType
 
 import ojota.sources
 
 from ojota.sources import JSONSource
-from ojota.cache import Cache
+from ojota.cache import Cache, DummyCache, MISS, approximate_size
+from ojota.columns import ColumnStore
+from ojota.indexes import HashIndex
 import six
 
 
@@ -40,10 +47,143 @@ def set_data_source(data_path):
     ojota.sources._DATA_SOURCE = data_path
 
 
-def preload(*args):
-    for arg in args:
-        if hasattr(arg, "preload"):
-            arg.preload()
+def preload(*args, **kwargs):
+    """Reads the elements of the given classes into their caches.
+
+    Arguments:
+        args -- the Ojota classes to preload.
+        data_codes -- the data codes to preload the classes for. Defaults to
+        the current one.
+        for_fork -- prepares the elements to be shared with forked processes.
+        Builds the tables of the classes and freezes the garbage collector,
+        so the children do not copy the pages just by touching them. Returns
+        a dictionary with the approximate bytes preloaded by cache name.
+    """
+    for_fork = kwargs.pop("for_fork", False)
+    data_codes = kwargs.pop("data_codes", None)
+    if kwargs:
+        raise TypeError("Unexpected arguments: %s" % ", ".join(kwargs))
+    previous_data_code = get_current_data_code()
+    if data_codes is None:
+        data_codes = [previous_data_code]
+
+    report = {}
+    try:
+        for data_code in data_codes:
+            current_data_code(data_code)
+            for arg in args:
+                if not hasattr(arg, "preload"):
+                    continue
+                if for_fork:
+                    table = arg.preload(for_fork=True)
+                    report[arg.get_cache_name()] = approximate_size(
+                        (table.elements, table.rows, table.objects))
+                else:
+                    arg.preload()
+    finally:
+        current_data_code(previous_data_code)
+
+    if for_fork:
+        gc.collect()
+        # moves everything to the permanent generation, so the collections
+        # in the children do not write to the shared pages (Python 3.7+)
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        return report
+
+
+def get_current_transaction():
+    """Returns the Transaction running in the current thread, if any."""
+    return Transaction._running.get(current_thread())
+
+
+class Transaction(object):
+    """Context manager that defers the changes made with save, update, delete
+    and the bulk methods. The changes are kept in a working copy of the
+    elements of every touched class, that the queries in the same thread see,
+    and are saved once per class when the block ends without errors. When
+    the block raises they are discarded.
+
+    The writes of different classes are not atomic between them.
+    """
+    _running = {}
+
+    def __init__(self):
+        self._pending = []
+        self._nested = False
+
+    def __enter__(self):
+        thread = current_thread()
+        if thread in self._running:
+            self._nested = True
+            return self._running[thread]
+        self._running[thread] = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._nested:
+            return False
+        del self._running[current_thread()]
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def _get_pending(self, cls, create=False):
+        cache_name = cls.get_cache_name()
+        for pending in self._pending:
+            if pending["class"] is cls and \
+                    pending["cache_name"] == cache_name:
+                return pending
+        if create:
+            elements = dict(cls._read_all_from_datasource())
+            pending = {"class": cls, "cache_name": cache_name,
+                       "data_code": get_current_data_code(),
+                       "elements": elements, "changes": []}
+            self._pending.append(pending)
+            return pending
+
+    def get_elements(self, cls):
+        """Returns the working copy of the elements of a class, or None if
+        the class was not changed in the transaction.
+
+        Arguments:
+            cls -- the Ojota class.
+        """
+        pending = self._get_pending(cls)
+        if pending is not None:
+            return pending["elements"]
+
+    def add_changes(self, cls, changes):
+        """Applies changes to the working copy of a class.
+
+        Arguments:
+            cls -- the Ojota class.
+            changes -- a list of ("set", element data) and ("delete", pk)
+            tuples.
+        """
+        pending = self._get_pending(cls, create=True)
+        cls._apply_changes(pending["elements"], changes, prefilter=True)
+        pending["changes"].extend(changes)
+        cls._tables.pop(pending["cache_name"], None)
+
+    def commit(self):
+        """Saves the changes of every touched class."""
+        data_code = get_current_data_code()
+        try:
+            for pending in self._pending:
+                current_data_code(pending["data_code"])
+                pending["class"]._persist_changes(pending["changes"])
+        finally:
+            current_data_code(data_code)
+            self._pending = []
+
+    def rollback(self):
+        """Discards the changes."""
+        for pending in self._pending:
+            pending["class"]._tables.pop(pending["cache_name"], None)
+        self._pending = []
 
 
 class Relation(object):
@@ -157,26 +297,411 @@ class WSRelation(Relation):
         return ret
 
 
+_MISSING = object()
+
+
+def _split_expression(expression):
+    """Splits a filter expression into its field and operation."""
+    expression_parts = expression.split('__')
+    if len(expression_parts) == 1:
+        field = expression
+        operation = '='
+    else:
+        field, operation = expression_parts
+    return field, operation
+
+
+def _compare(function, swap=False):
+    """Returns a predicate factory for a comparison with the value."""
+    def _bind(field, value):
+        if swap:
+            def _predicate(element_data):
+                try:
+                    return function(value, element_data[field])
+                except KeyError:
+                    return False
+        else:
+            def _predicate(element_data):
+                try:
+                    return function(element_data[field], value)
+                except KeyError:
+                    return False
+        return _predicate
+    return _bind
+
+
+def _compare_str(method, lower=False):
+    """Returns a predicate factory for a string method called on the field
+    with the value, that is converted (and lowered) once."""
+    def _bind(field, value):
+        value = str(value)
+        if lower:
+            value = value.lower()
+
+            def _predicate(element_data):
+                try:
+                    return method(str(element_data[field]).lower(), value)
+                except KeyError:
+                    return False
+        else:
+            def _predicate(element_data):
+                try:
+                    return method(str(element_data[field]), value)
+                except KeyError:
+                    return False
+        return _predicate
+    return _bind
+
+
+def _bind_range(field, value):
+    low, high = value[0], value[1]
+
+    def _predicate(element_data):
+        try:
+            return low <= element_data[field] <= high
+        except KeyError:
+            return False
+    return _predicate
+
+
+_OPERATIONS = {
+    '=': _compare(eq),
+    'exact': _compare(eq),
+    'iexact': _compare_str(eq, lower=True),
+    'contains': _compare(contains),
+    'icontains': _compare_str(lambda field, value: value in field,
+                              lower=True),
+    'in': _compare(contains, swap=True),
+    'gt': _compare(gt),
+    'gte': _compare(ge),
+    'lt': _compare(lt),
+    'lte': _compare(le),
+    'startswith': _compare_str(str.startswith),
+    'istartswith': _compare_str(str.startswith, lower=True),
+    'endswith': _compare_str(str.endswith),
+    'iendswith': _compare_str(str.endswith, lower=True),
+    'range': _bind_range,
+    'ne': _compare(ne),
+}
+
+_MAX_FILTER_PLANS = 1000
+_filter_plans = {}
+
+
+def _get_filter_plan(expressions):
+    """Returns the compiled plan for a group of filter expressions, a list of
+    (field, predicate factory) tuples. Plans are cached by the expressions.
+
+    Arguments:
+        expressions -- a tuple with the filter expressions.
+    """
+    plan = _filter_plans.get(expressions)
+    if plan is None:
+        plan = []
+        for expression in expressions:
+            field, operation = _split_expression(expression)
+            try:
+                plan.append((field, _OPERATIONS[operation]))
+            except KeyError:
+                raise AttributeError(
+                    "The operation %s does not exist" % operation)
+        if len(_filter_plans) >= _MAX_FILTER_PLANS:
+            _filter_plans.clear()
+        _filter_plans[expressions] = plan
+    return plan
+
+
+def _compile_filters(filters):
+    """Compiles a dictionary of filters into a list of predicates that take
+    the element data and return True if it matches.
+
+    Arguments:
+        filters -- a dictionary with the filters
+    """
+    expressions = tuple(filters.keys())
+    plan = _get_filter_plan(expressions)
+    return [bind(field, filters[expression])
+            for expression, (field, bind) in zip(expressions, plan)]
+
+
+# guards the _flights of every class
+_flights_lock = Lock()
+
+
+class _Flight(object):
+    """A load of the elements of a cache name in progress, that the other
+    threads wait for instead of loading them too."""
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class _Table(object):
+    """In-process view of the cached elements of a class and the structures
+    derived from them. It is only valid for the elements object it was built
+    from, so a new one is built every time the cache is filled again."""
+    def __init__(self, ojota_class, elements, derived=True):
+        """Constructor for the _Table class.
+
+        Arguments:
+            ojota_class -- the Ojota class the elements belong to.
+            elements -- the dictionary of elements keyed by primary key.
+            derived -- build the indexes and columns of the class. Defaults
+            to True.
+        """
+        self.ojota_class = ojota_class
+        self.elements = elements
+        self.rows = list(elements.values())
+        self.objects = {}
+        self.indexes = {}
+        self.columns = None
+        if not derived:
+            return
+        for field, index_class in ojota_class.get_indexed_fields():
+            self.indexes[field] = index_class(field, self.rows)
+        if ojota_class.columnar:
+            fields = None
+            if ojota_class.columnar is not True:
+                fields = ojota_class.columnar
+            self.columns = ColumnStore(self.rows, fields)
+
+    def get_object(self, element_data):
+        """Returns the object for a row of this table. With identity_map
+        enabled every row is materialized only once per table.
+
+        Arguments:
+            element_data -- a row of this table.
+        """
+        ojota_class = self.ojota_class
+        if not ojota_class.identity_map:
+            return ojota_class._from_element_data(element_data)
+
+        pk = element_data[ojota_class.pk_field]
+        element = self.objects.get(pk)
+        if element is None:
+            element = ojota_class._from_element_data(element_data)
+            self.objects[pk] = element
+        return element
+
+    def filter(self, filters, subset=None):
+        """Applies the filters answering with the indexes, and then with the
+        columns, every lookup they support and scanning the candidates for
+        the rest.
+
+        Arguments:
+            filters -- a dictionary with the filters.
+            subset -- a list of rows of this table to restrict the result to.
+            Defaults to all the rows.
+        """
+        positions = None
+        mask = None
+        remaining = {}
+        for expression, value in list(filters.items()):
+            matched = None
+            column_mask = None
+            if expression.count('__') < 2:
+                field, operation = _split_expression(expression)
+                index = self.indexes.get(field)
+                if index is not None:
+                    matched = index.lookup(operation, value)
+                if matched is None and self.columns is not None:
+                    column_mask = self.columns.mask(field, operation, value)
+            if matched is not None:
+                if positions is None:
+                    positions = matched
+                else:
+                    positions &= matched
+            elif column_mask is not None:
+                if mask is None:
+                    mask = column_mask
+                else:
+                    mask &= column_mask
+            else:
+                remaining[expression] = value
+
+        if positions is not None:
+            positions = sorted(positions)
+            if mask is not None:
+                positions = [position for position in positions
+                             if mask[position]]
+        elif mask is not None:
+            positions = mask.nonzero()[0].tolist()
+
+        if positions is None:
+            candidates = self.rows if subset is None else subset
+        elif subset is None:
+            candidates = [self.rows[position] for position in positions]
+        else:
+            ids = set(id(self.rows[position]) for position in positions)
+            candidates = [row for row in subset if id(row) in ids]
+
+        if remaining:
+            candidates = self.ojota_class._filter(candidates, remaining)
+        return list(candidates)
+
+    def sort(self, rows, order_fields):
+        """Sorts rows of this table. When ordering by a single field with a
+        sorted index the order is taken from the index instead of sorting.
+
+        Arguments:
+            rows -- a list of rows of this table.
+            order_fields -- a string with the order fields
+        """
+        order_field = order_fields.strip()
+        reverse = order_field.startswith('-')
+        if reverse:
+            order_field = order_field[1:]
+        index = self.indexes.get(order_field)
+        positions = None
+        # sorting a few rows is cheaper than walking the whole index
+        if hasattr(index, "ordered_positions") and \
+                len(rows) * 8 >= len(self.rows):
+            positions = index.ordered_positions(reverse)
+
+        if positions is None:
+            ret = self.ojota_class._sort(rows, order_fields)
+        elif len(rows) == len(self.rows):
+            ret = [self.rows[position] for position in positions]
+        else:
+            ids = set(id(row) for row in rows)
+            ret = [self.rows[position] for position in positions
+                   if id(self.rows[position]) in ids]
+        return ret
+
+
+def _takes_plan(queryset_type):
+    """Returns True if a queryset type takes the table and query plan, False
+    for the custom types that are built from the element data alone.
+
+    Arguments:
+        queryset_type -- the queryset_type of an Ojota class.
+    """
+    if not isinstance(queryset_type, type) or \
+            not issubclass(queryset_type, OjotaSet):
+        return False
+    for klass in queryset_type.__mro__:
+        if klass is OjotaSet:
+            return True
+        if "__init__" in vars(klass):
+            return False
+    return True
+
+
 class OjotaSet(MutableSequence):
-    def __init__(self, ojota_class, data):
+    """Sequence of the elements returned by a query.
+
+    The filters, order and slice given to many() and [] are kept as a query
+    plan and only run, once, when the elements are first needed: on
+    iteration, len() or indexing.
+    """
+    def __init__(self, ojota_class, data, table=None, filters=None,
+                 order=None, slice_=None):
+        """Constructor for the OjotaSet class.
+
+        Arguments:
+            ojota_class -- the class of the elements.
+            data -- the element data the plan runs over.
+            table -- the _Table the data belongs to, if any.
+            filters -- a list of dictionaries with the filters to apply.
+            order -- a string with the order fields.
+            slice_ -- a slice to apply after filtering and ordering.
+        """
         super(OjotaSet, self).__init__()
-        self._list = list(data)
+        if not isinstance(data, list):
+            data = list(data)
         self.ojota_class = ojota_class
+        self._table = table
+        self._source = data
+        self._filters = filters or []
+        self._order = order
+        self._slice = slice_
+        self._result = None
+        self._owned = False
+
+    def _filter_stages(self):
+        """Merges the chained filters into as few dictionaries as possible.
+        Filters on an expression that was already used start a new stage."""
+        stages = []
+        merged = {}
+        for filters in self._filters:
+            if any(expression in merged for expression in filters):
+                stages.append(merged)
+                merged = {}
+            merged.update(filters)
+        if merged:
+            stages.append(merged)
+        return stages
+
+    def _execute(self):
+        """Runs the query plan and returns the list of element data."""
+        if self._result is None:
+            rows = self._source
+            table = self._table
+            for filters in self._filter_stages():
+                if table is not None:
+                    subset = None if rows is table.rows else rows
+                    rows = table.filter(filters, subset=subset)
+                else:
+                    rows = self.ojota_class._filter(rows, filters)
+            if self._order:
+                if table is not None:
+                    rows = table.sort(rows, self._order)
+                else:
+                    rows = self.ojota_class._sort(rows, self._order)
+            if self._slice is not None:
+                rows = rows[self._slice]
+            self._owned = rows is not self._source
+            self._result = rows
+        return self._result
+
+    @property
+    def _list(self):
+        return self._execute()
+
+    def _mutable_list(self):
+        """Returns the executed list, copied if it is shared with the source.
+        A mutated set no longer matches its table."""
+        rows = self._execute()
+        if not self._owned:
+            rows = self._result = list(rows)
+            self._owned = True
+        self._table = None
+        return rows
+
+    def _materialize(self, element_data):
+        if self._table is not None:
+            return self._table.get_object(element_data)
+        return self.ojota_class._from_element_data(element_data)
+
+    def _chain(self, data, **plan):
+        queryset_type = self.__class__
+        if not _takes_plan(queryset_type):
+            queryset_type = OjotaSet
+        return queryset_type(self.ojota_class, data, table=self._table,
+                             **plan)
 
     def __len__(self):
         return len(self._list)
 
+    def __iter__(self):
+        for element_data in self._list:
+            yield self._materialize(element_data)
+
     def __getitem__(self, indexes):
         if isinstance(indexes, slice):
-            list_ = self._list[indexes.start:indexes.stop:indexes.step]
-            ret = OjotaSet(self.ojota_class, list_)
+            if self._result is not None or self._slice is not None:
+                ret = self._chain(self._list[indexes])
+            else:
+                ret = self._chain(self._source, filters=self._filters,
+                                  order=self._order, slice_=indexes)
         else:
-            ret = self.ojota_class(**self._list[indexes])
+            ret = self._materialize(self._list[indexes])
 
         return ret
 
     def __delitem__(self, ii):
-        del self._list[ii]
+        del self._mutable_list()[ii]
 
     def __setitem__(self, ii, val):
         raise NotImplementedError
@@ -189,25 +714,86 @@ class OjotaSet(MutableSequence):
                                               self.ojota_class.plural_name)
 
     def insert(self, ii, val):
-        self._list.insert(ii, val)
+        self._mutable_list().insert(ii, val)
 
     def append(self, val):
         list_idx = len(self._list)
         self.insert(list_idx, val)
 
     def many(self, **kwargs):
-        elems = self.ojota_class._filter(self._list, kwargs)
-        return OjotaSet(self.ojota_class, elems)
+        order = kwargs.pop('sorted', None)
+        if kwargs:
+            _get_filter_plan(tuple(kwargs.keys()))
+            filters = [kwargs]
+        else:
+            filters = []
+
+        if self._result is not None or self._slice is not None:
+            ret = self._chain(self._list, filters=filters, order=order)
+        else:
+            ret = self._chain(self._source, filters=self._filters + filters,
+                              order=order or self._order)
+        return ret
 
     def one(self, **kwargs):
         return self.ojota_class.one(**kwargs)
 
 
+def _schema_fields(self):
+    """Returns the names of the fields set on an element with a schema."""
+    fields = [name for name in self.fields_schema if hasattr(self, name)]
+    fields.extend(self.__dict__.keys())
+    return fields
+
+
+def _compile_constructor(cls):
+    """Generates the function that builds the elements of a class with a
+    fields_schema from the element data, setting the slots directly and
+    skipping the required fields validation."""
+    namespace = {"new": object.__new__, "cls": cls, "MISSING": _MISSING,
+                 "schema": frozenset(cls.fields_schema)}
+    lines = ["def _from_element_data(element_data):",
+             "    element = new(cls)",
+             "    found = 0",
+             "    get = element_data.get"]
+    for position, name in enumerate(cls.fields_schema):
+        descriptor = getattr(cls, name, None)
+        if isinstance(descriptor, MemberDescriptorType):
+            setter = "set_%d(element, value)" % position
+            namespace["set_%d" % position] = descriptor.__set__
+        else:
+            setter = "setattr(element, %r, value)" % name
+        lines.extend(["    value = get(%r, MISSING)" % name,
+                      "    if value is not MISSING:",
+                      "        %s" % setter,
+                      "        found += 1"])
+    lines.extend(["    if found != len(element_data):",
+                  "        for key, value in element_data.items():",
+                  "            if key not in schema:",
+                  "                setattr(element, key, value)",
+                  "    return element"])
+    six.exec_("\n".join(lines), namespace)
+    return namespace["_from_element_data"]
+
+
 class MetaOjota(type):
     """Metaclass for Ojota"""
+    def __new__(mcs, name, bases, attrs):
+        schema = attrs.get("fields_schema")
+        if schema and "__slots__" not in attrs:
+            attrs["__slots__"] = tuple(
+                field for field in schema
+                if not any(hasattr(base, field) for base in bases))
+            attrs["fields"] = property(_schema_fields)
+        return super(MetaOjota, mcs).__new__(mcs, name, bases, attrs)
+
     def __init__(self, *args, **kwargs):
         self.relations = {}
         self.backwards_relations = []
+        self._tables = {}
+        self._tables_cache = None
+        self._signatures = {}
+        self._flights = {}
         for attr, value in list(self.__dict__.items()):
             if isinstance(value, Relation):
                 value.set_reversed_property(self)
@@ -216,6 +802,14 @@ class MetaOjota(type):
             elif isinstance(value, Callback):
                 setattr(self, attr, value.get_property())
 
+        if self.fields_schema:
+            required_fields = list(self.required_fields or [])
+            if self.pk_field not in required_fields:
+                required_fields.append(self.pk_field)
+            self.required_fields = tuple(required_fields)
+            self._from_element_data = staticmethod(
+                _compile_constructor(self))
+
         return super(MetaOjota, self).__init__(*args, **kwargs)
 
 
@@ -233,6 +827,11 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
     queryset_type = OjotaSet
     prefilter = None
     cache_name = None
+    indexed_fields = None
+    identity_map = False
+    fields_schema = None
+    columnar = False
+    freshness_interval = None
 
     @property
     def primary_key(self):
@@ -250,21 +849,35 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
 
     def __init__(self, _pk=None, **kwargs):
         """Constructor."""
-        self.fields = []
-        if self.required_fields is None:
-            self.required_fields = []
+        if self.fields_schema:
+            # fields and required_fields are computed for the whole class
+            fields = []
         else:
-            self.required_fields = list(self.required_fields)
-        if self.pk_field not in self.required_fields:
-            self.required_fields.append(self.pk_field)
+            self.fields = fields = []
+            if self.required_fields is None:
+                self.required_fields = []
+            else:
+                self.required_fields = list(self.required_fields)
+            if self.pk_field not in self.required_fields:
+                self.required_fields.append(self.pk_field)
 
         for key in self.required_fields:
             if key not in kwargs:
                 raise AttributeError("The field '%s' is required" % key)
         for key, val in list(kwargs.items()):
-            self.fields.append(key)
+            fields.append(key)
             setattr(self, key, val)
 
+    @classmethod
+    def _from_element_data(cls, element_data):
+        """Builds an element from data read from the cache. Classes with a
+        fields_schema replace it with a generated constructor.
+
+        Arguments:
+            element_data -- a dictionary with the element data.
+        """
+        return cls(**element_data)
+
     @classmethod
     def get_current_data_code(cls):
         return get_current_data_code()
@@ -286,37 +899,230 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
         the data is not on the root according to the data path."""
         cache_name = cls.get_cache_name()
 
-        if cache_name not in cls.cache:
-            elements = cls.data_source.fetch_elements(cls)
-            if cls.prefilter is not None:
-                elements_ = cls._filter(list(elements.values()), cls.prefilter)
-                elements = {}
-                for elem in elements_:
-                    elements[elem[cls.pk_field]] = elem
+        transaction = get_current_transaction()
+        if transaction is not None:
+            elements = transaction.get_elements(cls)
+            if elements is not None:
+                return elements
+
+        elements = cls.cache.get_or_miss(cache_name)
+        if elements is MISS:
+            elements = cls._load_elements_once(cache_name, missed=True)
+        elif not cls._is_fresh(cache_name):
+            elements = cls._load_elements_once(cache_name)
+        return elements
+
+    @classmethod
+    def _load_elements_once(cls, cache_name, missed=False):
+        """Loads the elements, making the concurrent callers for the same
+        cache name wait for the result of the first one instead of reading
+        the data source again. Between processes sharing the cache it holds
+        the lock of the cache.
 
-            cls.cache.set(name=cache_name, elems=elements)
-        else:
-            elements = cls.cache.get(cache_name)
+        Arguments:
+            cache_name -- the cache name of the elements.
+            missed -- True if the elements were not cached, so another
+            process sharing the cache may have loaded them while waiting for
+            the lock.
+        """
+        with _flights_lock:
+            flight = cls._flights.get(cache_name)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                cls._flights[cache_name] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            with cls.cache.lock(cache_name):
+                elements = MISS
+                if missed and cls.cache.shared:
+                    elements = cls.cache.get_or_miss(cache_name)
+                if elements is MISS:
+                    elements = cls._load_elements(cache_name)
+            flight.result = elements
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with _flights_lock:
+                cls._flights.pop(cache_name, None)
+            flight.done.set()
+        return elements
+
+    @classmethod
+    def _load_elements(cls, cache_name):
+        """Reads the elements from the data source, stores them in the cache
+        and builds the indexes and columns of the class.
+
+        Arguments:
+            cache_name -- the cache name of the elements.
+        """
+        if cls.freshness_interval is not None:
+            cls._signatures[cache_name] = (
+                cls.data_source.get_signature(cls), time.time())
+        elements = cls._fetch_elements()
+        cls.cache.set(name=cache_name, elems=elements)
+        if (cls.indexed_fields or cls.columnar) and \
+                cls.cache.holds(cache_name, elements):
+            cls._store_table(cache_name, _Table(cls, elements))
         return elements
 
+    @classmethod
+    def reload(cls):
+        """Reads the elements from the data source again and replaces the
+        cached ones for the current data code."""
+        return cls._load_elements(cls.get_cache_name())
+
+    @classmethod
+    def _fetch_elements(cls):
+        """Reads the elements from the data source and applies the prefilter.
+        """
+        elements = cls.data_source.fetch_elements(cls)
+        if cls.prefilter is not None:
+            elements_ = cls._filter(list(elements.values()), cls.prefilter)
+            elements = {}
+            for elem in elements_:
+                elements[elem[cls.pk_field]] = elem
+        return elements
+
+    @classmethod
+    def _is_fresh(cls, cache_name):
+        """Returns False if the files of the data source changed since the
+        elements were read. The files are checked at most once every
+        freshness_interval milliseconds, and never if it is None.
+
+        Arguments:
+            cache_name -- the cache name of the elements.
+        """
+        if cls.freshness_interval is None:
+            return True
+
+        now = time.time()
+        checked = cls._signatures.get(cache_name)
+        if checked is not None and \
+                now - checked[1] < cls.freshness_interval / 1000.0:
+            return True
+
+        signature = cls.data_source.get_signature(cls)
+        fresh = checked is None or checked[0] == signature
+        if fresh:
+            cls._signatures[cache_name] = (signature, now)
+        return fresh
+
+    @classmethod
+    def get_indexed_fields(cls):
+        """Returns a list of (field, index class) tuples for the fields
+        declared in indexed_fields. It can be a sequence of field names, which
+        get a HashIndex, or a dictionary mapping field names to index classes.
+        """
+        if not cls.indexed_fields:
+            return []
+        if isinstance(cls.indexed_fields, dict):
+            return list(cls.indexed_fields.items())
+        return [(field, HashIndex) for field in cls.indexed_fields]
+
+    @classmethod
+    def _get_table(cls):
+        """Returns the _Table for the current elements, building it when the
+        cache was filled again since the last call.
+
+        The caches that return a new copy of the elements on every read, like
+        Memcache, would need the indexes and columns built again for every
+        query, so their tables are scanned instead.
+        """
+        elements = cls._read_all_from_datasource()
+        cache_name = cls.get_cache_name()
+        table = cls._tables.get(cache_name)
+        if table is None or table.elements is not elements:
+            table = _Table(cls, elements,
+                           derived=cls.cache.holds(cache_name, elements))
+            cls._store_table(cache_name, table)
+        return table
+
+    @classmethod
+    def _store_table(cls, cache_name, table):
+        """Keeps a table for as long as the cache keeps its elements.
+
+        Arguments:
+            cache_name -- the cache name of the elements.
+            table -- the _Table built from them.
+        """
+        cache = cls.cache
+        if not cache.holds(cache_name, table.elements):
+            cls._tables.pop(cache_name, None)
+            return
+
+        if cls._tables_cache is not cache:
+            class_ref = weakref.ref(cls)
+
+            def release(name):
+                ojota_class = class_ref()
+                if ojota_class is not None:
+                    ojota_class._tables.pop(name, None)
+
+            cache.add_listener(release)
+            cls._tables_cache = cache
+        cls._tables[cache_name] = table
+
     @classmethod
     def _read_item_from_datasource(cls, pk):
         """Reads the data form the datasource if support index search."""
         cache_name = cls.get_cache_name()
 
-        element = cls.data_source.fetch_element(cls, pk)
-        if cache_name in cls.cache:
-            cache = cls.cache.get(cache_name)
-            cache.update(element)
-            cls.cache.set(name=cache_name, elems=cache)
-        else:
-            cache = element
-        return cache[pk]
+        data_source = cls.data_source
+        element_data = data_source.fetch_element(cls, pk).get(pk)
+        if element_data is not None and cls.prefilter is not None and \
+                not cls._filter([element_data], cls.prefilter):
+            element_data = None
+        # the files are cached whole when they are read, only the web
+        # services keep the elements they return one by one
+        if element_data is not None and data_source.file_extension is None:
+            cached = cls.cache.get_item_or_miss(cache_name, pk)
+            if cached != element_data:
+                cls.cache.set_item(cache_name, pk, element_data)
+                cls._tables.pop(cache_name, None)
+        return element_data
+
+    @classmethod
+    def _read_item_from_cache(cls, pk):
+        """Returns the data of an element, looking up only that element in
+        the cache when it supports it, or None if it does not exist. When it
+        is not cached the sources with point reads read only that element.
+
+        Arguments:
+            pk -- the primary key of the element.
+        """
+        cache_name = cls.get_cache_name()
+        if get_current_transaction() is None:
+            if cls._is_fresh(cache_name):
+                element_data = cls.cache.get_item_or_miss(cache_name, pk)
+                if element_data is not MISS:
+                    return element_data
+            if cls.data_source.point_reads:
+                return cls._read_item_from_datasource(pk)
+        return cls._read_all_from_datasource().get(pk)
 
     @classmethod
-    def _objetize(cls, data):
-        """Return the data into an element."""
-        return cls.queryset_type(cls, data)
+    def _objetize(cls, data, **plan):
+        """Return the data into an element.
+
+        Arguments:
+            data -- the element data.
+            plan -- the table and query plan for the OjotaSet.
+        """
+        plan = dict((key, value) for key, value in plan.items() if value)
+        queryset_type = cls.queryset_type
+        if plan and not _takes_plan(queryset_type):
+            # built from the result, like before the query plans
+            data = OjotaSet(cls, data, **plan)._execute()
+            plan = {}
+        return queryset_type(cls, data, **plan)
 
     @classmethod
     def _test_expression(cls, expression, value, element_data):
@@ -331,55 +1137,10 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
         "lte", "startswith", "istartswith", "endswith", "iendswith", "range"
         and "ne"
         """
-        expression_parts = expression.split('__')
-        if len(expression_parts) == 1:
-            field = expression
-            operation = '='
-        else:
-            field, operation = expression_parts
-
-        r = True
-        try:
-            if operation in ('=', 'exact'):
-                r = element_data[field] == value
-            elif operation == 'iexact':
-                r = str(element_data[field]).lower() == str(value).lower()
-            elif operation == 'contains':
-                r = value in element_data[field]
-            elif operation == 'icontains':
-                r = str(value).lower() in str(element_data[field]).lower()
-            elif operation == 'in':
-                r = element_data[field] in value
-            elif operation == 'gt':
-                r = element_data[field] > value
-            elif operation == 'gte':
-                r = element_data[field] >= value
-            elif operation == 'lt':
-                r = element_data[field] < value
-            elif operation == 'lte':
-                r = element_data[field] <= value
-            elif operation == 'startswith':
-                r = str(element_data[field]).startswith(str(value))
-            elif operation == 'istartswith':
-                r = str(element_data[field]).lower().startswith(
-                    str(value).lower())
-            elif operation == 'endswith':
-                r = str(element_data[field]).endswith(str(value))
-            elif operation == 'iendswith':
-                r = str(element_data[field]).lower().endswith(
-                    str(value).lower())
-            elif operation == 'range':
-                r = value[0] <= element_data[field] <= value[1]
-            elif operation == 'ne':
-                r = element_data[field] != value
-            else:
-                raise AttributeError(
-                    "The operation %s does not exist" % operation)
-        except KeyError:
-            r = False
+        predicate = _compile_filters({expression: value})[0]
         # TODO date operations
         # TODO regex operations
-        return r
+        return predicate(element_data)
 
     @classmethod
     def _filter(cls, data, filters):
@@ -389,16 +1150,13 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
             data -- an iterable containing the data
             filters -- a dictionary with the filters
         """
-        filtrados = []
-        for element_data in data:
-            add = True
-            for expression, value in list(filters.items()):
-                if not cls._test_expression(expression, value, element_data):
-                    add = False
-                    break
-            if add:
-                filtrados.append(element_data)
+        filtrados = data
+        for predicate in _compile_filters(filters):
+            filtrados = [element_data for element_data in filtrados
+                         if predicate(element_data)]
 
+        if filtrados is data:
+            filtrados = list(data)
         return filtrados
 
     @classmethod
@@ -434,21 +1192,52 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
     @classmethod
     def many(cls, **kargs):
         """Returns all the elements that match the conditions."""
-        elements = list(cls._read_all_from_datasource().values())
         order_fields = cls.default_order
         if 'sorted' in kargs:
             order_fields = kargs['sorted']
             del kargs['sorted']
 
+        filters = []
         if kargs:
-            elements = cls._filter(elements, kargs)
+            # fail early for operations that do not exist
+            _get_filter_plan(tuple(kargs.keys()))
+            filters.append(kargs)
 
-        if order_fields:
-            elements = cls._sort(elements, order_fields)
+        if cls._is_streaming():
+            return cls._objetize(cls._stream_rows(filters),
+                                 order=order_fields)
 
-        list_ = cls._objetize(elements)
+        table = cls._get_table()
+        list_ = cls._objetize(table.rows, table=table, filters=filters,
+                              order=order_fields)
         return list_
 
+    @classmethod
+    def _is_streaming(cls):
+        """Returns True if the queries read the elements one by one from the
+        data source, which is done for streaming sources when the elements
+        are not cached anyway."""
+        return (cls.data_source.streaming and
+                isinstance(cls.cache, DummyCache) and
+                get_current_transaction() is None)
+
+    @classmethod
+    def _stream_rows(cls, filters):
+        """Yields the element data that match the filters and the prefilter,
+        reading the elements one by one from the data source.
+
+        Arguments:
+            filters -- a list of dictionaries with the filters.
+        """
+        if cls.prefilter is not None:
+            filters = [cls.prefilter] + filters
+        predicates = []
+        for filters_ in filters:
+            predicates.extend(_compile_filters(filters_))
+        for element_data in cls.data_source.stream_elements(cls):
+            if all(predicate(element_data) for predicate in predicates):
+                yield element_data
+
     @classmethod
     def one(cls, pk=None, **kargs):
         """Returns the first element that matches the conditions."""
@@ -457,13 +1246,14 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
             kargs[cls.pk_field] = pk
         if list(kargs.keys()) == [cls.pk_field]:
             pk = kargs[cls.pk_field]
-            if hasattr(cls.data_source, 'get_cmd'):
-                elem = cls._read_item_from_datasource(pk)
-                element = cls._objetize([elem])[0]
+            if cls.identity_map:
+                table = cls._get_table()
+                if pk in table.elements:
+                    element = table.get_object(table.elements[pk])
             else:
-                all_elems = cls._read_all_from_datasource()
-                if pk in all_elems:
-                    element = cls(**all_elems[pk])
+                element_data = cls._read_item_from_cache(pk)
+                if element_data is not None:
+                    element = cls._from_element_data(element_data)
         else:
             result = cls.many(**kargs)
             if result:
@@ -505,27 +1295,157 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
                 setattr(self, arg, value)
         self.dump_values()
 
-    def dump_values(self, new_data=None, delete=False):
-        """Saves the data into a file."""
-        elements = self.__class__.many()
-        json_data = []
-        for element in elements:
-            if element == self:
-                if not delete:
-                    data = self.to_dict()
-                else:
-                    data = None
+    @classmethod
+    def _apply_changes(cls, elements, changes, prefilter=False):
+        """Applies changes to a dictionary of elements.
+
+        Arguments:
+            elements -- the dictionary of elements keyed by primary key.
+            changes -- a list of ("set", element data) and ("delete", pk)
+            tuples.
+            prefilter -- leave out the elements that do not match the
+            prefilter. Defaults to False.
+        """
+        for operation, data in changes:
+            if operation == "delete":
+                elements.pop(data, None)
+                continue
+            pk = data[cls.pk_field]
+            if prefilter and cls.prefilter is not None and \
+                    not cls._filter([data], cls.prefilter):
+                elements.pop(pk, None)
             else:
-                data = element.to_dict()
-            if data is not None:
-                json_data.append(data)
+                elements[pk] = data
+        return elements
+
+    @classmethod
+    def _invalidate(cls):
+        """Clears the cached elements and the structures derived from them.
+        """
+        cache_name = cls.get_cache_name()
+        cls.cache.clear(cache_name)
+        cls._tables.pop(cache_name, None)
+        cls._signatures.pop(cache_name, None)
+
+    @classmethod
+    def _journal_changes(cls, changes):
+        """Appends changes to the journal of the data source and applies them
+        to the cached elements, so they do not have to be read again.
+
+        Arguments:
+            changes -- a list of ("set", element data) and ("delete", pk)
+            tuples.
+        """
+        cache_name = cls.get_cache_name()
+        checked = cls._signatures.get(cache_name)
+        if checked is not None and \
+                checked[0] != cls.data_source.get_signature(cls):
+            checked = None
+        cls.data_source.append_changes(cls, changes)
+        # the cached elements read the same as the data source
+        changes = cls.data_source.decode_changes(cls, changes)
+        if checked is not None:
+            # the cached elements are only missing our own changes
+            cls._signatures[cache_name] = (
+                cls.data_source.get_signature(cls), time.time())
+        elements = cls.cache.get_or_miss(cache_name)
+        if elements is not MISS:
+            cls._apply_changes(elements, changes, prefilter=True)
+            cls.cache.set(name=cache_name, elems=elements)
+        cls._tables.pop(cache_name, None)
+
+    @classmethod
+    def _persist_changes(cls, changes):
+        """Applies changes to the elements and saves them with a single write
+        to the data source.
+
+        Arguments:
+            changes -- a list of ("set", element data) and ("delete", pk)
+            tuples.
+        """
+        transaction = get_current_transaction()
+        if transaction is not None:
+            transaction.add_changes(cls, changes)
+            return
+
+        if cls.data_source.journal:
+            cls._journal_changes(changes)
+            return
+
+        elements = dict(cls._read_all_from_datasource())
+        cls._apply_changes(elements, changes)
+        data = list(elements.values())
+        if cls.default_order:
+            data = cls._sort(data, cls.default_order)
+        cls.data_source.save(cls, data)
+        cls._invalidate()
+
+    @classmethod
+    def bulk_create(cls, elements):
+        """Saves many new elements with a single write to the data source.
+        Elements with a primary key that already exists replace it.
+
+        Arguments:
+            elements -- an iterable of instances of the class.
+        """
+        changes = [("set", element.to_dict()) for element in elements]
+        if changes:
+            cls._persist_changes(changes)
+
+    @classmethod
+    def bulk_update(cls, elements, fields):
+        """Updates the given fields of many elements with a single write to
+        the data source. Elements that are not stored are ignored.
+
+        Arguments:
+            elements -- an iterable of instances of the class.
+            fields -- a list with the names of the fields to update.
+        """
+        stored = cls._read_all_from_datasource()
+        changes = []
+        for element in elements:
+            data = stored.get(element.primary_key)
+            if data is None:
+                continue
+            data = dict(data)
+            for field in fields:
+                data[field] = getattr(element, field)
+            changes.append(("set", data))
+        if changes:
+            cls._persist_changes(changes)
+
+    @classmethod
+    def bulk_delete(cls, pks):
+        """Deletes many elements with a single write to the data source.
+
+        Arguments:
+            pks -- an iterable with the primary keys of the elements.
+        """
+        changes = [("delete", pk) for pk in pks]
+        if changes:
+            cls._persist_changes(changes)
 
-        if new_data is not None:
-            json_data.append(new_data)
+    @classmethod
+    def transaction(cls):
+        """Returns a Transaction to use in a with block. It defers the changes
+        of every class, not only this one."""
+        return Transaction()
+
+    @classmethod
+    def compact(cls):
+        """Folds the journal of the data source back into the data file."""
+        cls.data_source.compact(cls)
+        cls._invalidate()
 
-        self.data_source.save(self.__class__, json_data)
-        cache_name = self.__class__.get_cache_name()
-        self.cache.clear(cache_name)
+    def dump_values(self, new_data=None, delete=False):
+        """Saves the data into a file."""
+        if delete:
+            change = ("delete", self.primary_key)
+        elif new_data is not None:
+            change = ("set", new_data)
+        else:
+            change = ("set", self.to_dict())
+        self.__class__._persist_changes([change])
 
     def delete(self):
         self.dump_values(delete=True)
@@ -534,7 +1454,10 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
         """Save function for an object."""
         ojota_fields = ("fields", "required_fields", "relations",
                         "backwards_relations")
-        data = self.__dict__
+        if self.fields_schema:
+            data = self.to_dict()
+        else:
+            data = self.__dict__
 
         if all([field in list(data.keys()) for field in self.required_fields]):
             new_data = {}
@@ -548,8 +1471,22 @@ class Ojota(six.with_metaclass(MetaOjota, object)):
                 self.update(**new_data)
 
     @classmethod
-    def preload(cls):
-        cls.many()
+    def preload(cls, for_fork=False):
+        """Reads the elements into the cache.
+
+        Arguments:
+            for_fork -- also builds the table of the class, with its indexes,
+            columns and, with identity_map, every object, and returns it.
+        """
+        if not for_fork:
+            cls.many()
+            return
+
+        table = cls._get_table()
+        if cls.identity_map:
+            for row in table.rows:
+                table.get_object(row)
+        return table
 
 
 class OjotaHierarchy(Ojota):
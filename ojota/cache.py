@@ -1,15 +1,102 @@
 from __future__ import absolute_import
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import RLock
+
+import six
+from six.moves import cPickle as pickle
+
 try:
     import memcache
     memcache_imported = True
 except:
     memcache_imported = False
 
+try:
+    import lz4.frame
+    lz4_imported = True
+except ImportError:
+    lz4_imported = False
+
+try:
+    import fcntl
+    fcntl_imported = True
+except ImportError:
+    fcntl_imported = False
+
+
+# returned by get_or_miss when the name is not cached
+MISS = object()
+
+
+def approximate_size(obj):
+    """Returns the approximate number of bytes used by an object and the
+    containers, strings and numbers it holds. Shared objects are counted once.
+
+    Arguments:
+        obj -- the object to measure.
+    """
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(six.iterkeys(obj))
+            pending.extend(six.itervalues(obj))
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+    return size
+
 
 class Cache(object):
     """The base Cache class.
     Stores the cached data in memory.
     """
+    # True for the caches shared between processes, that another process
+    # may fill while this one waits for the lock
+    shared = False
+
+    def add_listener(self, listener):
+        """Registers a function that is called with the name of every entry
+        the cache drops by itself, because it was evicted, expired or did
+        not fit, to release what was derived from it.
+
+        Arguments:
+            listener -- a function that takes the cache name.
+        """
+        if "_listeners" not in self.__dict__:
+            self._listeners = []
+        self._listeners.append(listener)
+
+    def _notify(self, name):
+        for listener in self.__dict__.get("_listeners", ()):
+            listener(name)
+
+    def holds(self, name, elems):
+        """Returns True if the cache keeps that same object under a name, so
+        what is derived from it can be kept while it is cached.
+
+        Arguments:
+            name -- the cache name.
+            elems -- the cached data.
+        """
+        return self.__dict__.get(name, MISS) is elems
+
     def set(self, name, elems):
         """Sets the data into cache.
 
@@ -27,6 +114,45 @@ class Cache(object):
         """
         return getattr(self, name)
 
+    def get_or_miss(self, name):
+        """Gets the data from cache with a single lookup, or MISS if it is
+        not cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        try:
+            return self.get(name)
+        except AttributeError:
+            return MISS
+
+    def get_item_or_miss(self, name, pk):
+        """Gets the data of one element from cache, or MISS if it is not
+        cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+        """
+        elems = self.get_or_miss(name)
+        if elems is MISS:
+            return MISS
+        return elems.get(pk, MISS)
+
+    def set_item(self, name, pk, data):
+        """Sets the data of one element into the cached data, if it is
+        cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+            data -- the element data.
+        """
+        elems = self.get_or_miss(name)
+        if elems is not MISS:
+            elems[pk] = data
+            self.set(name, elems)
+
     def __contains__(self, name):
         """Returns True if a given element is cached.
 
@@ -37,13 +163,38 @@ class Cache(object):
         return has_data
 
     def clear(self, name):
-        return delattr(self, name)
+        if name in self.__dict__:
+            delattr(self, name)
+
+    @contextmanager
+    def lock(self, name):
+        """Context manager that holds a lock on a name for every process
+        sharing the cache, while one of them loads the data. The caches that
+        are not shared do not need it.
+
+        Arguments:
+            name -- the cache name.
+        """
+        yield
 
 
 class Memcache(Cache):
-    """Stores the cached data in memcache."""
+    """Stores the cached data in memcache.
+
+    The pickles bigger than compress_threshold are compressed, and the
+    values bigger than chunk_size are split in several keys, listed by a
+    version stamped manifest stored under the cache name.
+    """
+    # prefix of the values written by this class, followed by a flag: P for
+    # pickles, Z for zlib, L for lz4 and C for chunk manifests. Values
+    # without it are plain pickles written by older versions.
+    MAGIC = b"\x00OJ"
+    shared = True
+
     def __init__(self, cache_location="127.0.0.1", port=11211,
-                 expiration_time=None, debug=None):
+                 expiration_time=None, debug=None, client=None,
+                 compress_threshold=10 * 1024, compression="zlib",
+                 chunk_size=1000 * 1000, lock_timeout=30):
         """Constructor for the Memcache class.
 
         Arguments:
@@ -51,13 +202,175 @@ class Memcache(Cache):
             port -- memcached port. Defaults to 11211
             expiration_time -- memcache expiration time
             debug -- activate memcache debug. Defaults to None
+            client -- a memcache client to use instead of creating one.
+            compress_threshold -- the pickles bigger than this number of
+            bytes are compressed. None disables the compression.
+            compression -- "zlib" or "lz4". Defaults to "zlib".
+            chunk_size -- the biggest value stored in a single key. Defaults
+            to a bit less than the 1MB memcached allows.
+            lock_timeout -- the seconds a lock is held at most, in case its
+            holder dies. Defaults to 30.
         """
-        if memcache_imported:
+        if client is not None:
+            self._mc = client
+        elif memcache_imported:
             self._mc = memcache.Client(["%s:%d" % (cache_location, port)],
                                        debug=debug)
-            self.expiration_time = expiration_time
         else:
             raise Exception("In order to use Memcache as cache you should install the 'memcache' package")
+        if compression == "lz4" and not lz4_imported:
+            raise Exception("In order to use lz4 compression you should install the 'lz4' package")
+        elif compression not in ("zlib", "lz4"):
+            raise ValueError("Unknown compression '%s'" % compression)
+        self.expiration_time = expiration_time
+        self.compress_threshold = compress_threshold
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.lock_timeout = lock_timeout
+
+    def _dumps(self, data):
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        flag = b"P"
+        if self.compress_threshold is not None and \
+                len(payload) > self.compress_threshold:
+            if self.compression == "lz4":
+                compressed, compressed_flag = lz4.frame.compress(payload), b"L"
+            else:
+                compressed, compressed_flag = zlib.compress(payload), b"Z"
+            if len(compressed) < len(payload):
+                payload, flag = compressed, compressed_flag
+        return self.MAGIC + flag + payload
+
+    def _loads(self, value):
+        if not value.startswith(self.MAGIC):
+            return pickle.loads(value)
+
+        start = len(self.MAGIC)
+        flag, payload = value[start:start + 1], value[start + 1:]
+        if flag == b"Z":
+            payload = zlib.decompress(payload)
+        elif flag == b"L":
+            if not lz4_imported:
+                raise Exception("In order to read lz4 compressed values you should install the 'lz4' package")
+            payload = lz4.frame.decompress(payload)
+        return pickle.loads(payload)
+
+    def _set_value(self, key, data):
+        """Stores data under a key, splitting it in chunks if it is too big.
+        """
+        value = self._dumps(data)
+        if len(value) > self.chunk_size:
+            version = uuid.uuid4().hex
+            chunks = {}
+            for position in range(0, len(value), self.chunk_size):
+                chunk_key = "%s:%s:%d" % (key, version, len(chunks))
+                chunks[chunk_key] = value[position:position + self.chunk_size]
+            self._mc.set_multi(chunks, self.expiration_time)
+            value = self.MAGIC + b"C" + pickle.dumps((version, len(chunks)))
+        self._mc.set(key, value, self.expiration_time)
+
+    def _get_value(self, key):
+        """Returns the data stored under a key, or MISS."""
+        value = self._mc.get(key)
+        if value is None:
+            return MISS
+        if value.startswith(self.MAGIC + b"C"):
+            version, count = pickle.loads(value[len(self.MAGIC) + 1:])
+            chunk_keys = ["%s:%s:%d" % (key, version, position)
+                          for position in range(count)]
+            chunks = self._mc.get_multi(chunk_keys)
+            if len(chunks) < count:
+                return MISS
+            value = b"".join(chunks[chunk_key] for chunk_key in chunk_keys)
+        return self._loads(value)
+
+    def set(self, name, elems):
+        """Sets the data into cache.
+
+        Arguments:
+            name -- the cache name.
+            elems -- the data to cache.
+        """
+        self._set_value(str(name), elems)
+
+    def get(self, name):
+        """Gets the data from cache.
+
+        Arguments:
+            name -- the cache name.
+        """
+        elems = self.get_or_miss(name)
+        if elems is MISS:
+            raise AttributeError(name)
+        return elems
+
+    def get_or_miss(self, name):
+        """Gets the data from cache with a single round trip, unless it is
+        chunked, or MISS if it is not cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        return self._get_value(str(name))
+
+    def __contains__(self, name):
+        """Returns True if a given element is cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        return self.get_or_miss(name) is not MISS
+
+    def clear(self, name):
+        self._mc.delete(str(name))
+
+    def holds(self, name, elems):
+        # every get unpickles a new copy
+        return False
+
+    @contextmanager
+    def lock(self, name):
+        """Context manager that holds a lock on a name, using the atomic add
+        of memcache. After lock_timeout seconds it stops waiting.
+
+        Arguments:
+            name -- the cache name.
+        """
+        key = "%s:lock" % name
+        deadline = time.time() + self.lock_timeout
+        acquired = self._mc.add(key, b"1", self.lock_timeout)
+        while not acquired and time.time() < deadline:
+            time.sleep(0.05)
+            acquired = self._mc.add(key, b"1", self.lock_timeout)
+        try:
+            yield
+        finally:
+            if acquired:
+                self._mc.delete(key)
+
+
+class RecordMemcache(Memcache):
+    """Stores the cached data in memcache with a key for every element, so
+    a single element is read without transferring the whole table.
+
+    A manifest key holds the primary keys of the elements and the version
+    of the table, which is also stored with every element. The elements
+    of an older version are ignored.
+    """
+    def _get_record_key(self, name, pk):
+        digest = hashlib.sha1(repr(pk).encode("utf-8")).hexdigest()
+        return "%s:%s" % (name, digest)
+
+    def _get_version_key(self, name):
+        return "%s:version" % name
+
+    def _get_manifest(self, name):
+        """Returns the (version, primary keys) manifest of a table, or None.
+        """
+        manifest = self._get_value(name)
+        if manifest is MISS:
+            return None
+        return manifest
 
     def set(self, name, elems):
         """Sets the data into cache.
@@ -66,8 +379,174 @@ class Memcache(Cache):
             name -- the cache name.
             elems -- the data to cache.
         """
-        self._mc.set(str(name), memcache.pickle.dumps(elems),
+        name = str(name)
+        version = uuid.uuid4().hex
+        records = {}
+        for pk, data in elems.items():
+            records[self._get_record_key(name, pk)] = \
+                self._dumps((version, data))
+        if records:
+            self._mc.set_multi(records, self.expiration_time)
+        self._mc.set(self._get_version_key(name), self._dumps(version),
                      self.expiration_time)
+        # the manifest goes last so it never lists missing elements
+        self._set_value(name, (version, list(elems)))
+
+    def get_or_miss(self, name):
+        """Gets the data from cache, or MISS if it is not cached or some of
+        its elements were evicted.
+
+        Arguments:
+            name -- the cache name.
+        """
+        name = str(name)
+        manifest = self._get_manifest(name)
+        if manifest is None:
+            return MISS
+
+        version, pks = manifest
+        keys = [self._get_record_key(name, pk) for pk in pks]
+        records = self._mc.get_multi(keys) if keys else {}
+        elems = {}
+        for pk, key in zip(pks, keys):
+            if key not in records:
+                return MISS
+            record_version, data = self._loads(records[key])
+            if record_version != version:
+                return MISS
+            elems[pk] = data
+        return elems
+
+    def get_item_or_miss(self, name, pk):
+        """Gets the data of one element from cache with a single round trip,
+        or MISS if it is not cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+        """
+        name = str(name)
+        version_key = self._get_version_key(name)
+        record_key = self._get_record_key(name, pk)
+        values = self._mc.get_multi([version_key, record_key])
+        if version_key not in values or record_key not in values:
+            return MISS
+        record_version, data = self._loads(values[record_key])
+        if record_version != self._loads(values[version_key]):
+            return MISS
+        return data
+
+    def set_item(self, name, pk, data):
+        """Sets the data of one element into the cached data, if it is
+        cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+            data -- the element data.
+        """
+        name = str(name)
+        manifest = self._get_manifest(name)
+        if manifest is None:
+            return
+
+        version, pks = manifest
+        self._mc.set(self._get_record_key(name, pk),
+                     self._dumps((version, data)), self.expiration_time)
+        if pk not in pks:
+            pks.append(pk)
+            self._set_value(name, (version, pks))
+
+    def __contains__(self, name):
+        """Returns True if a given element is cached, reading only the
+        manifest.
+
+        Arguments:
+            name -- the cache name.
+        """
+        return self._get_manifest(str(name)) is not None
+
+    def clear(self, name):
+        # the elements are left to expire, they no longer match a version
+        name = str(name)
+        self._mc.delete_multi([name, self._get_version_key(name)])
+
+
+class LRUCache(Cache):
+    """Stores the cached data in memory, keeping at most max_entries entries
+    and max_bytes approximate bytes. The least recently used entries are
+    evicted first and every entry expires ttl seconds after it was set.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None,
+                 sizeof=approximate_size):
+        """Constructor for the LRUCache class.
+
+        Arguments:
+            max_entries -- the maximum number of entries. Defaults to None,
+            no limit.
+            max_bytes -- the approximate memory budget in bytes. Defaults to
+            None, no limit.
+            ttl -- the seconds an entry lives. Defaults to None, forever.
+            sizeof -- the function used to measure the entries.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def _remove(self, name):
+        elems, size, expires = self._entries.pop(name)
+        self.size -= size
+
+    def _lookup(self, name):
+        """Returns the entry for a name, removing it if it expired."""
+        entry = self._entries.get(name)
+        if entry is not None and entry[2] is not None and \
+                entry[2] <= time.time():
+            self._remove(name)
+            self.expirations += 1
+            self._notify(name)
+            entry = None
+        return entry
+
+    def set(self, name, elems, ttl=None):
+        """Sets the data into cache.
+
+        Arguments:
+            name -- the cache name.
+            elems -- the data to cache.
+            ttl -- the seconds this entry lives. Defaults to the ttl of the
+            cache.
+        """
+        size = self.sizeof(elems) if self.max_bytes is not None else 0
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            if name in self._entries:
+                self._remove(name)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # it would evict everything else and still not fit
+                self.evictions += 1
+                self._notify(name)
+                return
+            self._entries[name] = (elems, size, expires)
+            self.size += size
+            while (self.max_entries is not None and
+                   len(self._entries) > self.max_entries) or \
+                    (self.max_bytes is not None and
+                     self.size > self.max_bytes):
+                evicted = next(iter(self._entries))
+                self._remove(evicted)
+                self.evictions += 1
+                self._notify(evicted)
 
     def get(self, name):
         """Gets the data from cache.
@@ -75,7 +554,28 @@ class Memcache(Cache):
         Arguments:
             name -- the cache name.
         """
-        return memcache.pickle.loads(self._mc.get(str(name)))
+        elems = self.get_or_miss(name)
+        if elems is MISS:
+            raise AttributeError(name)
+        return elems
+
+    def get_or_miss(self, name):
+        """Gets the data from cache with a single lookup, or MISS if it is
+        not cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        with self._lock:
+            entry = self._lookup(name)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            self.hits += 1
+            # move it to the end as the most recently used
+            del self._entries[name]
+            self._entries[name] = entry
+            return entry[0]
 
     def __contains__(self, name):
         """Returns True if a given element is cached.
@@ -83,8 +583,394 @@ class Memcache(Cache):
         Arguments:
             name -- the cache name.
         """
-        _in_cache = not self._mc.get(str(name)) is None
-        return _in_cache
+        with self._lock:
+            return self._lookup(name) is not None
+
+    def clear(self, name):
+        with self._lock:
+            if name in self._entries:
+                self._remove(name)
+
+    def holds(self, name, elems):
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry is not None and entry[0] is elems
+
+    def stats(self):
+        """Returns a dictionary with the cache statistics."""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+
+class TieredCache(Cache):
+    """Keeps the data of a shared cache, the L2, in a small in-process cache,
+    the L1. A generation token stored in the L2 with every table tells when
+    the copy in the L1 is outdated, so only that token is read from the L2
+    while the table does not change.
+    """
+    def __init__(self, l2, l1=None):
+        """Constructor for the TieredCache class.
+
+        Arguments:
+            l2 -- the shared cache, like a Memcache.
+            l1 -- the in-process cache. Defaults to an LRUCache with 32
+            entries.
+        """
+        self.l2 = l2
+        if l1 is None:
+            l1 = LRUCache(max_entries=32)
+        self.l1 = l1
+        # the tables are only kept while they are in the L1
+        self.l1.add_listener(self._notify)
+
+    def _get_generation_key(self, name):
+        return "%s:generation" % name
+
+    def _get_generation(self, name):
+        """Returns the generation of a table in the L2, or MISS."""
+        # stored as a table, since the L2 may only know how to store those
+        stored = self.l2.get_or_miss(self._get_generation_key(name))
+        if stored is MISS:
+            return MISS
+        return stored.get("generation", MISS)
+
+    def _set_generation(self, name):
+        generation = uuid.uuid4().hex
+        self.l2.set(self._get_generation_key(name),
+                    {"generation": generation})
+        return generation
+
+    def _get_local(self, name, generation):
+        """Returns the data in the L1 if it has that generation, or MISS."""
+        entry = self.l1.get_or_miss(name)
+        if entry is not MISS and entry[0] == generation:
+            return entry[1]
+        return MISS
+
+    def set(self, name, elems):
+        """Sets the data into cache.
+
+        Arguments:
+            name -- the cache name.
+            elems -- the data to cache.
+        """
+        self.l2.set(name, elems)
+        # the generation goes last, so it is never newer than the data
+        generation = self._set_generation(name)
+        self.l1.set(name, (generation, elems))
+
+    def get(self, name):
+        """Gets the data from cache.
+
+        Arguments:
+            name -- the cache name.
+        """
+        elems = self.get_or_miss(name)
+        if elems is MISS:
+            raise AttributeError(name)
+        return elems
+
+    def get_or_miss(self, name):
+        """Gets the data from cache, reading it from the L2 only when its
+        generation changed, or MISS if it is not cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        generation = self._get_generation(name)
+        if generation is MISS:
+            self.l1.clear(name)
+            return MISS
+
+        elems = self._get_local(name, generation)
+        if elems is MISS:
+            elems = self.l2.get_or_miss(name)
+            if elems is not MISS:
+                self.l1.set(name, (generation, elems))
+        return elems
+
+    def get_item_or_miss(self, name, pk):
+        """Gets the data of one element from cache, or MISS if it is not
+        cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+        """
+        generation = self._get_generation(name)
+        if generation is MISS:
+            return MISS
+
+        elems = self._get_local(name, generation)
+        if elems is MISS:
+            return self.l2.get_item_or_miss(name, pk)
+        return elems.get(pk, MISS)
+
+    def set_item(self, name, pk, data):
+        """Sets the data of one element into the cached data, if it is
+        cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+            data -- the element data.
+        """
+        self.l1.clear(name)
+        self.l2.set_item(name, pk, data)
+        if self._get_generation(name) is not MISS:
+            self._set_generation(name)
+
+    def __contains__(self, name):
+        """Returns True if a given element is cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        return self.get_or_miss(name) is not MISS
+
+    def clear(self, name):
+        self.l1.clear(name)
+        self.l2.clear(self._get_generation_key(name))
+        self.l2.clear(name)
+
+    @property
+    def shared(self):
+        return self.l2.shared
+
+    def lock(self, name):
+        return self.l2.lock(name)
+
+    def holds(self, name, elems):
+        entry = self.l1.get_or_miss(name)
+        return entry is not MISS and entry[1] is elems
+
+
+class SharedMemoryCache(Cache):
+    """Stores the cached data pickled in memory mapped files, shared by all
+    the processes of the host. Every file starts with a version header, and
+    each process only unpickles a table again when its version changed.
+
+    The elements are pickled one by one after a directory with their
+    offsets, so reading a single element only unpickles that element. A
+    whole table is still unpickled into a copy in every process that reads
+    it, the elements are not shared as Python objects.
+
+    By default the files are kept in /dev/shm, so they live in memory.
+    """
+    HEADER = struct.Struct("!4sQQQ")
+    MAGIC = b"OJS2"
+    shared = True
+
+    def __init__(self, path=None, prefix="ojota"):
+        """Constructor for the SharedMemoryCache class.
+
+        Arguments:
+            path -- the directory for the files. Defaults to /dev/shm or the
+            temporary directory.
+            prefix -- prefix for the file names, to share a directory between
+            applications.
+        """
+        if path is None:
+            if os.path.isdir("/dev/shm"):
+                path = "/dev/shm"
+            else:
+                path = tempfile.gettempdir()
+        self.path = path
+        self.prefix = prefix
+        self._loaded = {}
+        self._directories = {}
+
+    def _get_path(self, name):
+        name = str(name)
+        if not re.match(r"^[A-Za-z0-9_.-]+$", name):
+            name = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, "%s%s" % (self.prefix, name))
+
+    def set(self, name, elems):
+        """Sets the data into cache.
+
+        Arguments:
+            name -- the cache name.
+            elems -- the data to cache.
+        """
+        records = []
+        position = 0
+        if isinstance(elems, dict):
+            offsets = {}
+            for pk, data in elems.items():
+                record = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+                offsets[pk] = (position, len(record))
+                records.append(record)
+                position += len(record)
+            directory = (offsets, None)
+        else:
+            directory = (None, elems)
+        directory = pickle.dumps(directory, pickle.HIGHEST_PROTOCOL)
+        version = struct.unpack("!Q", os.urandom(8))[0]
+        path = self._get_path(name)
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".ojota")
+        try:
+            os.write(fd, self.HEADER.pack(self.MAGIC, version,
+                                          len(directory), position))
+            os.write(fd, directory)
+            for record in records:
+                os.write(fd, record)
+        finally:
+            os.close(fd)
+        os.chmod(temp_path, 0o644)
+        # the readers keep the previous file mapped until they are done
+        os.rename(temp_path, path)
+        self._loaded[name] = (version, elems)
+        self._directories.pop(name, None)
+
+    def _map(self, name):
+        """Returns the mapped file of a name and the version of its data, or
+        (None, None) if it is not cached."""
+        try:
+            data_file = open(self._get_path(name), "rb")
+        except IOError:
+            return None, None
+
+        try:
+            size = os.fstat(data_file.fileno()).st_size
+            if size < self.HEADER.size:
+                return None, None
+            mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            data_file.close()
+
+        magic, version, directory_length, records_length = \
+            self.HEADER.unpack_from(mapped, 0)
+        if magic != self.MAGIC or self.HEADER.size + directory_length + \
+                records_length > len(mapped):
+            mapped.close()
+            return None, None
+        return mapped, version
+
+    def _get_directory(self, name, mapped, version):
+        """Returns the offsets of the elements, the data when it is not a
+        dictionary and where the elements start."""
+        directory = self._directories.get(name)
+        if directory is None or directory[0] != version:
+            start = self.HEADER.size
+            directory_length = self.HEADER.unpack_from(mapped, 0)[2]
+            offsets, value = pickle.loads(
+                mapped[start:start + directory_length])
+            directory = (version, offsets, value, start + directory_length)
+            self._directories[name] = directory
+        return directory[1:]
+
+    def get_or_miss(self, name):
+        """Gets the data from cache, or MISS if it is not cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        mapped, version = self._map(name)
+        if mapped is None:
+            return MISS
+
+        try:
+            loaded = self._loaded.get(name)
+            if loaded is not None and loaded[0] == version:
+                return loaded[1]
+            offsets, value, start = self._get_directory(name, mapped,
+                                                        version)
+            if offsets is None:
+                elems = value
+            else:
+                elems = {}
+                for pk, (offset, length) in offsets.items():
+                    offset += start
+                    elems[pk] = pickle.loads(mapped[offset:offset + length])
+            self._loaded[name] = (version, elems)
+            return elems
+        finally:
+            mapped.close()
+
+    def get_item_or_miss(self, name, pk):
+        """Gets the data of one element from cache, unpickling only that
+        element, or MISS if it is not cached.
+
+        Arguments:
+            name -- the cache name.
+            pk -- the primary key of the element.
+        """
+        mapped, version = self._map(name)
+        if mapped is None:
+            return MISS
+
+        try:
+            loaded = self._loaded.get(name)
+            if loaded is not None and loaded[0] == version:
+                return loaded[1].get(pk, MISS)
+            offsets, value, start = self._get_directory(name, mapped,
+                                                        version)
+            if offsets is None:
+                return value.get(pk, MISS)
+            if pk not in offsets:
+                return MISS
+            offset, length = offsets[pk]
+            offset += start
+            return pickle.loads(mapped[offset:offset + length])
+        finally:
+            mapped.close()
+
+    def get(self, name):
+        """Gets the data from cache.
+
+        Arguments:
+            name -- the cache name.
+        """
+        elems = self.get_or_miss(name)
+        if elems is MISS:
+            raise AttributeError(name)
+        return elems
+
+    def __contains__(self, name):
+        """Returns True if a given element is cached.
+
+        Arguments:
+            name -- the cache name.
+        """
+        return os.path.exists(self._get_path(name))
+
+    def holds(self, name, elems):
+        loaded = self._loaded.get(name)
+        return loaded is not None and loaded[1] is elems
+
+    def clear(self, name):
+        self._loaded.pop(name, None)
+        self._directories.pop(name, None)
+        try:
+            os.remove(self._get_path(name))
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self, name):
+        """Context manager that holds a lock on a name with flock, for every
+        process of the host.
+
+        Arguments:
+            name -- the cache name.
+        """
+        if not fcntl_imported:
+            yield
+            return
+
+        lock_file = open(self._get_path(name) + ".lock", "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
 
 
 class DummyCache(Cache):
@@ -101,5 +987,11 @@ class DummyCache(Cache):
     def get(self, name):
         return self._cache
 
+    def get_or_miss(self, name):
+        return MISS
+
+    def holds(self, name, elems):
+        return False
+
     def __contains__(self, name):
         return False
@@ -0,0 +1,171 @@
+"""
+This file is part of Ojota.
+
+    Ojota is free software: you can redistribute it and/or modify
+    it under the terms of the GNU LESSER GENERAL PUBLIC LICENSE as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Ojota is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU  Lesser General Public License
+    along with Ojota.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import absolute_import
+import operator
+
+import six
+
+try:
+    import numpy
+    numpy_imported = True
+except ImportError:
+    numpy_imported = False
+
+
+_MISSING = object()
+
+_COMPARISONS = {
+    '=': operator.eq,
+    'exact': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+_SCALARS = (type(None), bool, float) + six.integer_types + six.string_types
+
+
+def _is_number(value):
+    return isinstance(value, six.integer_types + (float, )) and \
+        not isinstance(value, bool)
+
+
+class Column(object):
+    """The values of one field for all the rows of a table."""
+    def __init__(self, values):
+        """Constructor for the Column class.
+
+        Arguments:
+            values -- a list with the value of the field for each row, or
+            _MISSING for the rows that do not have it.
+        """
+        self.present = numpy.array([value is not _MISSING
+                                    for value in values], dtype=bool)
+        present_values = [value for value in values if value is not _MISSING]
+        self.numeric = bool(present_values) and \
+            all(_is_number(value) for value in present_values)
+        self.array = None
+        if self.numeric:
+            if all(isinstance(value, six.integer_types)
+                   for value in present_values):
+                dtype = numpy.int64
+            else:
+                dtype = numpy.float64
+            try:
+                self.array = numpy.array(
+                    [0 if value is _MISSING else value for value in values],
+                    dtype=dtype)
+            except OverflowError:
+                self.numeric = False
+
+        if self.array is None:
+            self.array = numpy.empty(len(values), dtype=object)
+            for position, value in enumerate(values):
+                if value is not _MISSING:
+                    self.array[position] = value
+
+    def mask(self, operation, value):
+        """Returns a boolean array with the rows that match the operation, or
+        None if it can not be evaluated on the whole column at once.
+
+        Arguments:
+            operation -- the operation name as used in the filters.
+            value -- the value to compare with.
+        """
+        try:
+            if self.numeric:
+                ret = self._numeric_mask(operation, value)
+            else:
+                ret = self._object_mask(operation, value)
+        except (TypeError, OverflowError):
+            ret = None
+        if ret is not None:
+            ret = ret & self.present
+        return ret
+
+    def _numeric_mask(self, operation, value):
+        if operation in _COMPARISONS:
+            if not _is_number(value):
+                return None
+            ret = _COMPARISONS[operation](self.array, value)
+        elif operation == 'range':
+            low, high = value[0], value[1]
+            if not (_is_number(low) and _is_number(high)):
+                return None
+            ret = (self.array >= low) & (self.array <= high)
+        elif operation == 'in' and not isinstance(value, six.string_types):
+            values = list(value)
+            if not all(_is_number(item) for item in values):
+                return None
+            ret = numpy.isin(self.array, values)
+        else:
+            ret = None
+        return ret
+
+    def _object_mask(self, operation, value):
+        # only equality is cheap to evaluate element-wise on object arrays
+        if operation not in ('=', 'exact', 'ne') or \
+                not isinstance(value, _SCALARS):
+            return None
+        ret = _COMPARISONS[operation](self.array, value)
+        if not isinstance(ret, numpy.ndarray):
+            return None
+        return ret.astype(bool)
+
+
+class ColumnStore(object):
+    """Column oriented copy of the rows of a table, used to evaluate the
+    filters as vectorized boolean masks."""
+    def __init__(self, rows, fields=None):
+        """Constructor for the ColumnStore class.
+
+        Arguments:
+            rows -- the list of element dictionaries.
+            fields -- the fields to store as columns. Defaults to every field
+            found in the rows.
+        """
+        if not numpy_imported:
+            msg = "In order to use columnar storage you should install "
+            msg += "the 'numpy' package"
+            raise Exception(msg)
+
+        if fields is None:
+            fields = set()
+            for row in rows:
+                fields.update(row)
+
+        self.size = len(rows)
+        self.columns = {}
+        for field in fields:
+            values = [row.get(field, _MISSING) for row in rows]
+            self.columns[field] = Column(values)
+
+    def mask(self, field, operation, value):
+        """Returns a boolean array with the rows that match the operation, or
+        None if it has to be evaluated row by row.
+
+        Arguments:
+            field -- the field name.
+            operation -- the operation name as used in the filters.
+            value -- the value to compare with.
+        """
+        column = self.columns.get(field)
+        if column is None:
+            return None
+        return column.mask(operation, value)
@@ -0,0 +1,178 @@
+"""
+This file is part of Ojota.
+
+    Ojota is free software: you can redistribute it and/or modify
+    it under the terms of the GNU LESSER GENERAL PUBLIC LICENSE as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Ojota is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU  Lesser General Public License
+    along with Ojota.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import absolute_import
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+import six
+
+
+class Index(object):
+    """Base class for the secondary indexes.
+
+    An index maps the values of a field to the positions of the elements that
+    hold them in the list of rows it was built from.
+    """
+    def __init__(self, field, rows):
+        """Constructor for the Index class.
+
+        Arguments:
+            field -- the name of the indexed field.
+            rows -- the list of element dictionaries to index.
+        """
+        self.field = field
+        self.usable = True
+        self.build(rows)
+
+    def build(self, rows):
+        raise NotImplementedError
+
+    def lookup(self, operation, value):
+        """Returns a set with the positions of the rows that match the
+        operation, or None if the index can not answer it.
+
+        Arguments:
+            operation -- the operation name as used in the filters.
+            value -- the value to compare with.
+        """
+        raise NotImplementedError
+
+
+class HashIndex(Index):
+    """Index for equality and "in" lookups. It is the default index type."""
+    def build(self, rows):
+        self._positions = {}
+        for position, row in enumerate(rows):
+            try:
+                value = row[self.field]
+            except KeyError:
+                continue
+            try:
+                self._positions.setdefault(value, []).append(position)
+            except TypeError:
+                # unhashable values can not be looked up by hash
+                self.usable = False
+                self._positions = {}
+                break
+
+    def lookup(self, operation, value):
+        if not self.usable:
+            return None
+
+        positions = set()
+        try:
+            if operation in ('=', 'exact'):
+                values = [value]
+            elif operation == 'in' and not isinstance(value,
+                                                      six.string_types):
+                values = list(value)
+            else:
+                return None
+
+            for item in values:
+                positions.update(self._positions.get(item, ()))
+        except TypeError:
+            return None
+        return positions
+
+
+class SortedIndex(Index):
+    """Index for equality, range and prefix lookups using binary search over
+    the presorted values of the field."""
+    def build(self, rows):
+        pairs = []
+        for position, row in enumerate(rows):
+            try:
+                pairs.append((row[self.field], position))
+            except KeyError:
+                continue
+        try:
+            pairs.sort(key=itemgetter(0))
+        except TypeError:
+            # values that can not be ordered can not be bisected
+            self.usable = False
+            pairs = []
+
+        self.keys = [key for key, position in pairs]
+        self.positions = [position for key, position in pairs]
+        self.complete = (self.usable and len(pairs) == len(rows) and
+                         None not in self.keys)
+        self.strings = all(isinstance(key, six.string_types)
+                           for key in self.keys)
+
+    def _slice(self, start, stop):
+        return set(self.positions[start:stop])
+
+    def lookup(self, operation, value):
+        if not self.usable:
+            return None
+
+        keys = self.keys
+        try:
+            if operation in ('=', 'exact'):
+                ret = self._slice(bisect_left(keys, value),
+                                  bisect_right(keys, value))
+            elif operation == 'in' and not isinstance(value,
+                                                      six.string_types):
+                ret = set()
+                for item in value:
+                    ret.update(self._slice(bisect_left(keys, item),
+                                           bisect_right(keys, item)))
+            elif operation == 'gt':
+                ret = self._slice(bisect_right(keys, value), None)
+            elif operation == 'gte':
+                ret = self._slice(bisect_left(keys, value), None)
+            elif operation == 'lt':
+                ret = self._slice(0, bisect_left(keys, value))
+            elif operation == 'lte':
+                ret = self._slice(0, bisect_right(keys, value))
+            elif operation == 'range':
+                ret = self._slice(bisect_left(keys, value[0]),
+                                  bisect_right(keys, value[1]))
+            elif operation == 'startswith' and self.strings and \
+                    isinstance(value, six.string_types):
+                start = stop = bisect_left(keys, value)
+                while stop < len(keys) and keys[stop].startswith(value):
+                    stop += 1
+                ret = self._slice(start, stop)
+            else:
+                ret = None
+        except TypeError:
+            ret = None
+        return ret
+
+    def ordered_positions(self, reverse=False):
+        """Returns the positions of all the rows ordered by the field, the
+        same way a stable sort would, or None if some rows can not be ordered
+        by the index.
+
+        Arguments:
+            reverse -- True for descending order.
+        """
+        if not self.complete:
+            return None
+        if not reverse:
+            return self.positions
+
+        # equal keys keep their original order in a reversed stable sort
+        ret = []
+        stop = len(self.keys)
+        while stop > 0:
+            start = bisect_left(self.keys, self.keys[stop - 1], 0, stop)
+            ret.extend(self.positions[start:stop])
+            stop = start
+        return ret
@@ -16,8 +16,14 @@ This file is part of Ojota.
 """
 from __future__ import absolute_import
 from __future__ import print_function
+import csv
+import mmap
 import os
 import json
+import tempfile
+from datetime import date, datetime
+
+import six
 from six.moves import zip
 
 try:
@@ -34,8 +40,10 @@ except ImportError:
 
 try:
     from openpyxl import Workbook, load_workbook
-    from openpyxl.cell import get_column_letter
-    from openpyxl.shared.exc import InvalidFileException
+    try:
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        from openpyxl.shared.exc import InvalidFileException
     openpyxl_imported = True
 except ImportError:
     openpyxl_imported = False
@@ -49,17 +57,170 @@ except ImportError:
 
 _DATA_SOURCE = "data"
 
+_JSON_WHITESPACE = " \t\n\r"
+
+_TRUE_VALUES = ("1", "true", "t", "yes", "y", "on")
+
+
+def _to_bool(value):
+    return value.strip().lower() in _TRUE_VALUES
+
+
+def _to_date(value):
+    return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+
+
+def _to_datetime(value):
+    value = value.strip()
+    for format_ in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S",
+                    "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value, format_)
+        except ValueError:
+            pass
+    raise ValueError("Invalid ISO date and time '%s'" % value)
+
+
+# the functions that parse the values of the declared CSV column types
+_CSV_CONVERTERS = {
+    bool: _to_bool,
+    date: _to_date,
+    datetime: _to_datetime,
+}
+
+
+def _get_columns(data):
+    """Returns the keys of the elements in the order they first appear."""
+    columns = []
+    seen = set()
+    for element in data:
+        for key in element:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+    return columns
+
+
+def _to_csv_value(value):
+    if value is None:
+        return ""
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode("utf-8")
+    return str(value)
+
+
+def _open_csv(path, mode):
+    """Opens a file for the csv module, which takes binary files on Python 2
+    and text files without newline translation on Python 3."""
+    if six.PY2:
+        return open(path, mode + 'b')
+    return open(path, mode, newline='')
+
+
+def _iter_json_array(json_file, chunk_size):
+    """Yields the items of the JSON array in a file one by one, reading the
+    file in chunks.
+
+    Arguments:
+        json_file -- the file with the JSON array.
+        chunk_size -- the number of characters read at once.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    state = "open"
+    while True:
+        while position < len(buffer) and \
+                buffer[position] in _JSON_WHITESPACE:
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of the JSON array")
+            chunk = json_file.read(chunk_size)
+            eof = not chunk
+            buffer, position = chunk, 0
+            continue
+
+        char = buffer[position]
+        if state == "open":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            position += 1
+            state = "first"
+        elif state in ("first", "separator") and char == "]":
+            return
+        elif state == "separator":
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in the JSON array")
+            position += 1
+            state = "item"
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                item, end = None, None
+            if end is not None and not eof:
+                # the item may continue in the file, like a number cut
+                # before its fraction or exponent, unless a separator or
+                # the end of the array follows it in the buffer
+                following = end
+                while following < len(buffer) and \
+                        buffer[following] in _JSON_WHITESPACE:
+                    following += 1
+                if following == len(buffer) or \
+                        buffer[following] not in ",]":
+                    end = None
+            if end is None:
+                if eof:
+                    raise ValueError("Invalid item in the JSON array")
+                chunk = json_file.read(chunk_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+            position = end
+            state = "separator"
+
+
+def _replace_file(temp_path, path):
+    """Moves a temporary file over a file, keeping the mode of the file it
+    replaces instead of the private mode of the temporary files.
+
+    Arguments:
+        temp_path -- the path of the temporary file.
+        path -- the path of the file to replace.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o644
+    os.chmod(temp_path, mode)
+    os.rename(temp_path, path)
+
 
 class Source(object):
     """Base class for all the data sources."""
-    def __init__(self, data_path=None, create_empty=True):
+    file_extension = None
+    streaming = False
+
+    @property
+    def point_reads(self):
+        """True if one() can read a single element with fetch_element. The
+        sources written for older versions tell it with a get_cmd."""
+        return hasattr(self, "get_cmd")
+
+    def __init__(self, data_path=None, create_empty=True, journal=False):
         """Constructor for the Source class.
 
         Arguments:
         data_path -- the path where the data is located.
+        journal -- append the changes to a journal file next to the data
+        instead of rewriting the data file on every save. Defaults to False.
         """
         self.data_path = data_path
         self.create_empty = create_empty
+        self.journal = journal
 
     def _get_file_path(self, cls):
         """Builds the path where the data will be located.
@@ -85,7 +246,23 @@ class Source(object):
             cls - the class with the data.
         """
         data_path = self._get_file_path(cls)
-        return self.read_elements(cls, data_path)
+        elements = self.read_elements(cls, data_path)
+        if self.journal:
+            self.replay_journal(cls, data_path, elements)
+        return elements
+
+    def stream_elements(self, cls):
+        """Returns an iterator over the element data of a class, that reads
+        them one by one when the source is streaming.
+
+        Arguments:
+            cls - the class with the data.
+        """
+        data_path = self._get_file_path(cls)
+        if self.journal:
+            # the changes in the journal need all the elements
+            return six.itervalues(self.fetch_elements(cls))
+        return self.iter_elements(cls, data_path)
 
     def fetch_element(self, cls, pk):
         """Fetch the elements for a given element of a class.
@@ -107,9 +284,134 @@ class Source(object):
         file_path = self._get_file_path(cls)
         self.write_elements(file_path, data)
 
+    def get_signature(self, cls):
+        """Returns the modification time, size and inode of the files holding
+        the data of a class, to find out if they changed. Returns None for
+        sources that are not files.
+
+        Arguments:
+            cls - the class with the data.
+        """
+        if self.file_extension is None:
+            return None
+
+        filepath = self._get_file_path(cls)
+        paths = ['%s.%s' % (filepath, self.file_extension)]
+        if self.journal:
+            paths.append(self._get_journal_path(filepath))
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime, stat.st_size, stat.st_ino))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _get_journal_path(self, filepath):
+        return '%s.journal' % filepath
+
+    def append_changes(self, cls, changes):
+        """Appends changes to the journal of a class.
+
+        Arguments:
+            cls - the class with the data.
+            changes - a list of ("set", element data) and ("delete", pk)
+            tuples.
+        """
+        lines = []
+        for operation, data in changes:
+            lines.append(json.dumps({operation: data},
+                                    default=self._encode_value) + "\n")
+        journal_path = self._get_journal_path(self._get_file_path(cls))
+        journal_file = open(journal_path, 'a')
+        journal_file.writelines(lines)
+        journal_file.close()
+
+    def _encode_value(self, value):
+        """Returns the JSON value written to the journal for a value that
+        JSON does not know."""
+        if isinstance(value, date):
+            return value.isoformat()
+        raise TypeError("%r is not JSON serializable" % (value,))
+
+    def _decode_element(self, data):
+        """Returns the element data of a change as it reads back from the
+        data file."""
+        return data
+
+    def _decode_pk(self, cls, pk):
+        """Returns a primary key of a change as it reads back from the data
+        file."""
+        return self._decode_element({cls.pk_field: pk}).get(cls.pk_field)
+
+    def decode_changes(self, cls, changes):
+        """Returns the changes with the values they will have when they are
+        read back from the data source.
+
+        Arguments:
+            cls - the class with the data.
+            changes - a list of ("set", element data) and ("delete", pk)
+            tuples.
+        """
+        decoded = []
+        for operation, data in changes:
+            if operation == "delete":
+                data = self._decode_pk(cls, data)
+            else:
+                data = self._decode_element(dict(data))
+            decoded.append((operation, data))
+        return decoded
+
+    def replay_journal(self, cls, filepath, elements):
+        """Applies the changes in the journal to the elements read from the
+        data file.
+
+        Arguments:
+            cls - the class with the data.
+            filepath -- the path for the data file.
+            elements -- the dictionary of elements read from the data file.
+        """
+        try:
+            journal_file = open(self._get_journal_path(filepath), 'r')
+        except IOError:
+            return elements
+
+        for line in journal_file:
+            try:
+                change = json.loads(line)
+            except ValueError:
+                # a write that was cut in the middle
+                continue
+            if "set" in change:
+                data = self._decode_element(change["set"])
+                elements[data[cls.pk_field]] = data
+            elif "delete" in change:
+                elements.pop(self._decode_pk(cls, change["delete"]), None)
+        journal_file.close()
+        return elements
+
+    def compact(self, cls):
+        """Writes the data file with the changes in the journal and removes
+        the journal.
+
+        Arguments:
+            cls - the class with the data.
+        """
+        file_path = self._get_file_path(cls)
+        elements = self.fetch_elements(cls)
+        self.write_elements(file_path, list(elements.values()))
+        try:
+            os.remove(self._get_journal_path(file_path))
+        except OSError:
+            pass
+
     def read_elements(self, cls, filepath):
         raise NotImplementedError
 
+    def iter_elements(self, cls, filepath):
+        return six.itervalues(self.read_elements(cls, filepath))
+
     def read_element(self, cls, url, pk):
         raise NotImplementedError
 
@@ -119,17 +421,27 @@ class Source(object):
 
 class JSONSource(Source):
     """Source class for the data stored with JSON format"""
+    file_extension = "json"
 
-    def __init__(self, data_path=None, create_empty=True, indent=4):
+    def __init__(self, data_path=None, create_empty=True, indent=4,
+                 journal=False, streaming=False, chunk_size=64 * 1024):
         """Constructor for the Source class.
 
         Arguments:
             data_path -- the path where the data is located.
             create_empty -- if file in data_path is not found, create an empty one.
             indent -- control the indentation of the JSON in the file.
+            journal -- append the changes to a journal instead of rewriting
+            the file on every save.
+            streaming -- parse the file incrementally, one element at a time,
+            instead of loading the whole file. Defaults to False.
+            chunk_size -- the number of characters read at once when
+            streaming.
         """
         self.indent = indent
-        super(JSONSource, self).__init__(data_path, create_empty)
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        super(JSONSource, self).__init__(data_path, create_empty, journal)
 
     def read_elements(self, cls, filepath):
         """Reads the elements form a JSON file. Returns a dictionary containing
@@ -138,6 +450,17 @@ class JSONSource(Source):
         Arguments:
             filepath -- the path for the json file.
         """
+        if self.streaming:
+            try:
+                return dict((element_data[cls.pk_field], element_data)
+                            for element_data in
+                            self.iter_elements(cls, filepath))
+            except KeyError:
+                msg = "Primary key was not found. Check that you have "
+                msg += "configured the class correctly. In case you "
+                msg += "have check your data source"
+                raise AttributeError(msg)
+
         json_path = '%s.json' % filepath
         try:
             json_file = open(json_path, 'r')
@@ -164,6 +487,32 @@ class JSONSource(Source):
 
         return elements
 
+    def iter_elements(self, cls, filepath):
+        """Yields the elements of a JSON file one by one, parsing the file
+        incrementally when streaming.
+
+        Arguments:
+            filepath -- the path for the json file.
+        """
+        if not self.streaming:
+            for element_data in Source.iter_elements(self, cls, filepath):
+                yield element_data
+            return
+
+        json_path = '%s.json' % filepath
+        try:
+            json_file = open(json_path, 'r')
+        except IOError:
+            if self.create_empty:
+                json_file = open(json_path, 'w')
+                json_file.write("[]")
+                json_file.close()
+            return
+
+        with json_file:
+            for element_data in _iter_json_array(json_file, self.chunk_size):
+                yield element_data
+
     def write_elements(self, filepath, data):
         data_set = open('%s.json' % filepath, 'w')
         json_data = json.dumps(data, indent=self.indent)
@@ -171,11 +520,255 @@ class JSONSource(Source):
         data_set.close()
 
 
+class JSONLinesSource(Source):
+    """Source class for the data stored with one JSON object per line.
+
+    A sidecar index with the offset and length of the line of every primary
+    key lets one() read a single line of the file. The changes are appended
+    to the file, where the last line of a primary key wins, and compact()
+    rewrites it.
+    """
+    file_extension = "jsonl"
+    streaming = True
+    point_reads = True
+    DELETE_KEY = "$delete"
+
+    def __init__(self, data_path=None, create_empty=True, journal=True):
+        """Constructor for the JSONLinesSource class.
+
+        Arguments:
+            data_path -- the path where the data is located.
+            create_empty -- if file in data_path is not found, create an
+            empty one.
+            journal -- append the changes to the file instead of rewriting
+            it on every save. Defaults to True.
+        """
+        super(JSONLinesSource, self).__init__(data_path, create_empty,
+                                              journal)
+        self._indexes = {}
+
+    def _get_data_path(self, filepath):
+        return '%s.jsonl' % filepath
+
+    def _get_index_path(self, filepath):
+        return '%s.jsonl.index' % filepath
+
+    def _scan(self, cls, data_file, start, offsets, elements=None):
+        """Reads the lines of the file from start, updating the offsets and
+        the elements. Returns where the last complete line ends.
+
+        Arguments:
+            cls -- the class with the data.
+            data_file -- the data file, opened in binary mode.
+            start -- the offset of the first line to read.
+            offsets -- a dictionary with the (offset, length) of the line of
+            every primary key.
+            elements -- a dictionary with the elements, if they are needed.
+        """
+        data_file.seek(start)
+        position = start
+        for line in data_file:
+            if not line.endswith(b"\n"):
+                # a write that was cut in the middle
+                break
+            data = json.loads(line.decode("utf-8"))
+            if self.DELETE_KEY in data:
+                pk = data[self.DELETE_KEY]
+                offsets.pop(pk, None)
+                if elements is not None:
+                    elements.pop(pk, None)
+            else:
+                try:
+                    pk = data[cls.pk_field]
+                except KeyError:
+                    msg = "Primary key was not found. Check that you have "
+                    msg += "configured the class correctly. In case you "
+                    msg += "have check your data source"
+                    raise AttributeError(msg)
+                offsets[pk] = (position, len(line))
+                if elements is not None:
+                    elements[pk] = data
+            position += len(line)
+        return position
+
+    def _load_index(self, filepath):
+        try:
+            index_file = open(self._get_index_path(filepath), 'r')
+        except IOError:
+            return None
+        try:
+            with index_file:
+                index = json.load(index_file)
+        except ValueError:
+            return None
+        index["offsets"] = dict((pk, (offset, length)) for pk, offset, length
+                                in index["offsets"])
+        return index
+
+    def _save_index(self, filepath, index):
+        data = dict(index)
+        data["offsets"] = [[pk, offset, length] for pk, (offset, length)
+                           in index["offsets"].items()]
+        index_path = self._get_index_path(filepath)
+        try:
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(index_path) or ".", prefix=".ojota")
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(data, index_file)
+            _replace_file(temp_path, index_path)
+        except (IOError, OSError):
+            # the index is only an optimization
+            pass
+
+    def _build_index(self, cls, filepath, elements=None):
+        """Returns the offsets of the lines of the elements. The stored index
+        is used while the file keeps its inode and only grew, reading just
+        the lines appended since it was built.
+
+        Arguments:
+            cls -- the class with the data.
+            filepath -- the path for the data file, without extension.
+            elements -- a dictionary to fill with the elements. When given
+            the whole file is read.
+        """
+        data_path = self._get_data_path(filepath)
+        try:
+            stat = os.stat(data_path)
+        except OSError:
+            if self.create_empty:
+                open(data_path, 'a').close()
+            return {}
+
+        index = None
+        if elements is None:
+            index = self._indexes.get(filepath) or self._load_index(filepath)
+        if index is not None:
+            same_file = index["inode"] == stat.st_ino
+            if not same_file or index["size"] > stat.st_size:
+                index = None
+            elif index["size"] == stat.st_size:
+                if index["mtime"] == stat.st_mtime:
+                    self._indexes[filepath] = index
+                    return index["offsets"]
+                # rewritten in place
+                index = None
+
+        with open(data_path, 'rb') as data_file:
+            if index is not None and index["size"]:
+                data_file.seek(index["size"] - 1)
+                if data_file.read(1) != b"\n":
+                    index = None
+            if index is None:
+                offsets = {}
+                start = 0
+            else:
+                offsets = dict(index["offsets"])
+                start = index["size"]
+            size = self._scan(cls, data_file, start, offsets, elements)
+
+        index = {"inode": stat.st_ino, "size": size,
+                 "mtime": stat.st_mtime, "offsets": offsets}
+        self._indexes[filepath] = index
+        self._save_index(filepath, index)
+        return offsets
+
+    def read_elements(self, cls, filepath):
+        """Reads the elements form a JSON lines file. Returns a dictionary
+        containing the read data.
+
+        Arguments:
+            filepath -- the path for the data file.
+        """
+        elements = {}
+        self._build_index(cls, filepath, elements)
+        return elements
+
+    def iter_elements(self, cls, filepath):
+        """Yields the elements of a JSON lines file one by one, in the order
+        of the file.
+
+        Arguments:
+            filepath -- the path for the data file.
+        """
+        offsets = self._build_index(cls, filepath)
+        if not offsets:
+            return
+        with open(self._get_data_path(filepath), 'rb') as data_file:
+            mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset, length in sorted(offsets.values()):
+                    line = mapped[offset:offset + length]
+                    yield json.loads(line.decode("utf-8"))
+            finally:
+                mapped.close()
+
+    def stream_elements(self, cls):
+        # the changes are in the data file, there is no journal to replay
+        return self.iter_elements(cls, self._get_file_path(cls))
+
+    def read_element(self, cls, filepath, pk):
+        """Reads one element from a JSON lines file, decoding only its line.
+        Returns a dictionary containing the read data, empty if the element
+        does not exist.
+
+        Arguments:
+            cls -- the data class.
+            filepath -- the path for the data file.
+            pk -- the primary key.
+        """
+        location = self._build_index(cls, filepath).get(pk)
+        if location is None:
+            return {}
+        offset, length = location
+        with open(self._get_data_path(filepath), 'rb') as data_file:
+            mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                line = mapped[offset:offset + length]
+            finally:
+                mapped.close()
+        return {pk: json.loads(line.decode("utf-8"))}
+
+    def write_elements(self, filepath, data):
+        data_path = self._get_data_path(filepath)
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(data_path) or ".", prefix=".ojota")
+        with os.fdopen(fd, 'wb') as data_file:
+            for element_data in data:
+                data_file.write((json.dumps(element_data) + "\n").encode(
+                    "utf-8"))
+        _replace_file(temp_path, data_path)
+        self._indexes.pop(filepath, None)
+
+    def append_changes(self, cls, changes):
+        """Appends changes to the data file of a class.
+
+        Arguments:
+            cls - the class with the data.
+            changes - a list of ("set", element data) and ("delete", pk)
+            tuples.
+        """
+        lines = []
+        for operation, data in changes:
+            if operation == "delete":
+                data = {self.DELETE_KEY: data}
+            lines.append((json.dumps(data, default=self._encode_value) +
+                          "\n").encode("utf-8"))
+        data_path = self._get_data_path(self._get_file_path(cls))
+        with open(data_path, 'ab') as data_file:
+            data_file.writelines(lines)
+
+    def replay_journal(self, cls, filepath, elements):
+        # the changes are appended to the data file itself
+        return elements
+
+
 class YAMLSource(Source):
     """Source class for the data stored with YAML format.
 
     requires the PyYaml package to run.
     """
+    file_extension = "yaml"
+
     def read_elements(self, cls, filepath):
         """Reads the elements form a JSON file. Returns a dictionary containing
         the read data.
@@ -205,6 +798,7 @@ class WebServiceSource(Source):
 
     """
     WSTIMEOUT = 5
+    point_reads = True
 
     def __init__(self, data_path=None, method="get", get_all_cmd="/all",
                  get_cmd="/data", user=None, password=None, cert=None,
@@ -280,30 +874,43 @@ class WebServiceSource(Source):
 
 
 class CSVSource(Source):
-    def __init__(self, data_path=None, separator=","):
-        Source.__init__(self, data_path=data_path)
+    """Source class for the data stored with CSV format"""
+    file_extension = "csv"
+
+    def __init__(self, data_path=None, separator=",", journal=False,
+                 types=None, streaming=False):
+        """Constructor for the CSVSource class.
+
+        Arguments:
+            data_path -- the path where the data is located.
+            separator -- the field separator. Defaults to ",".
+            journal -- append the changes to a journal instead of rewriting
+            the file on every save.
+            types -- a dictionary mapping column names to the type of their
+            values: int, float, bool, datetime.date, datetime.datetime or
+            any function that parses the text. The other columns are kept
+            as text.
+            streaming -- read the rows one by one when the elements are not
+            cached. Defaults to False.
+        """
+        Source.__init__(self, data_path=data_path, journal=journal)
         self.separator = separator
+        self.types = types or {}
+        self.streaming = streaming
+        self._converters = dict(
+            (column, _CSV_CONVERTERS.get(type_, type_))
+            for column, type_ in self.types.items())
 
-    """Source class for the data stored with JSON format"""
     def read_elements(self, cls, filepath):
-        """Reads the elements form a JSON file. Returns a dictionary containing
+        """Reads the elements form a CSV file. Returns a dictionary containing
         the read data.
 
         Arguments:
-            filepath -- the path for the json file.
+            filepath -- the path for the csv file.
         """
-        data = open('%s.csv' % filepath, 'r')
-        keys = data.readline().strip().split(self.separator)
-        dicts = [dict(list(zip(keys, elem.strip().split(
-            self.separator)))) for elem in data]
-
         try:
-            elements = {}
-            for element in dicts:
-                for key, value in list(element.items()):
-                    if value == "":
-                        del element[key]
-                elements[element[cls.pk_field]] = element
+            elements = dict((element[cls.pk_field], element)
+                            for element in self.iter_elements(cls, filepath))
         except KeyError:
             msg = "Primary key was not found. Check that you have "
             msg += "configured the class correctly. In case you "
@@ -312,79 +919,194 @@ class CSVSource(Source):
 
         return elements
 
-    def write_elements(self, filepath, data):
-        data_set = open('%s.csv' % filepath, 'w')
-        keys = []
-        for element in data:
-            keys.extend(list(element.keys()))
-        keys = set(keys)
-        lines = []
-        lines.append(self.separator.join(keys) + "\n")
-        for element in data:
-            line = self.separator.join([element.get(key, "") for key in keys])
-            lines.append(line + "\n")
+    def iter_elements(self, cls, filepath):
+        """Yields the elements of a CSV file one by one, without the empty
+        values and with the values of the typed columns parsed.
 
-        data_set.writelines(lines)
-        data_set.close()
+        Arguments:
+            filepath -- the path for the csv file.
+        """
+        with _open_csv('%s.csv' % filepath, 'r') as data:
+            reader = csv.reader(data, delimiter=str(self.separator))
+            try:
+                keys = next(reader)
+            except StopIteration:
+                return
+            columns = [(key.strip(), self._converters.get(key.strip()))
+                       for key in keys]
+            for row in reader:
+                element = {}
+                for (key, convert), value in zip(columns, row):
+                    if value != "":
+                        if convert is not None:
+                            value = convert(value)
+                        element[key] = value
+                if element:
+                    yield element
+
+    def _decode_element(self, data):
+        # the values as write_elements stores them and iter_elements reads
+        # them, so the journal reads the same as a rewritten file
+        element = {}
+        for key, value in data.items():
+            value = _to_csv_value(value)
+            if value != "":
+                convert = self._converters.get(key)
+                if convert is not None:
+                    value = convert(value)
+                element[key] = value
+        return element
+
+    def write_elements(self, filepath, data):
+        keys = _get_columns(data)
+        rows = ([_to_csv_value(element.get(key)) for key in keys]
+                for element in data)
+        with _open_csv('%s.csv' % filepath, 'w') as data_set:
+            writer = csv.writer(data_set, delimiter=str(self.separator),
+                                lineterminator="\n")
+            writer.writerow([_to_csv_value(key) for key in keys])
+            writer.writerows(rows)
 
 
 class XLSSource(Source):
-    def __init__(self, data_path=None, worksheet=0):
+    """Source class for the data stored in XLSX spreadsheets.
+
+    Requires the openpyxl package to run.
+    """
+    file_extension = "xlsx"
+
+    def __init__(self, data_path=None, worksheet=0, columns=None,
+                 streaming=False, data_only=False):
+        """Constructor for the XLSSource class.
+
+        Arguments:
+            data_path -- the path where the data is located.
+            worksheet -- the index or the name of the worksheet with the
+            data. Defaults to the first one.
+            columns -- the names of the columns to read. The primary key is
+            always read. Defaults to every column.
+            streaming -- read the rows one by one when the elements are not
+            cached. Defaults to False.
+            data_only -- read the values the spreadsheet saved for the
+            formulas instead of the formulas. Defaults to False.
+        """
         Source.__init__(self, data_path=data_path)
         self.worksheet = worksheet
+        self.columns = columns
+        self.streaming = streaming
+        self.data_only = data_only
+
+    def _get_worksheet(self, wb):
+        if isinstance(self.worksheet, six.string_types):
+            try:
+                return wb[self.worksheet]
+            except TypeError:
+                # openpyxl before 2.4
+                return wb.get_sheet_by_name(self.worksheet)
+        return wb.worksheets[self.worksheet]
 
-    """Source class for the data stored with JSON format"""
     def read_elements(self, cls, filepath):
-        """Reads the elements form a JSON file. Returns a dictionary containing
-        the read data.
+        """Reads the elements form a XLSX file. Returns a dictionary
+        containing the read data.
 
         Arguments:
-            filepath -- the path for the json file.
+            filepath -- the path for the xlsx file.
         """
-        elements = {}
-        if openpyxl_imported:
-            try:
-                wb = load_workbook('%s.xlsx' % filepath)
-                ws = wb.get_active_sheet()
-                rows = list(ws.rows)
-                keys = [row.value for row in rows.pop(0)]
-                for row in rows:
-                    row_dict = {}
-                    for key, cell in enumerate(row):
-                        row_dict[keys[key]] = cell.value
-                    elements[row_dict[cls.pk_field]] = row_dict
-            except InvalidFileException:
-                print("Warning, the file in invalid")
-        else:
-            raise Exception("In order to use XLS sources you should install the 'openpyxl' package")
+        try:
+            elements = dict((element[cls.pk_field], element)
+                            for element in self.iter_elements(cls, filepath))
+        except KeyError:
+            msg = "Primary key was not found. Check that you have "
+            msg += "configured the class correctly. In case you "
+            msg += "have check your data source"
+            raise AttributeError(msg)
 
         return elements
 
+    def iter_elements(self, cls, filepath):
+        """Yields the elements of a XLSX file one by one, reading the sheet
+        in read-only mode.
+
+        Arguments:
+            filepath -- the path for the xlsx file.
+        """
+        if not openpyxl_imported:
+            raise Exception("In order to use XLS sources you should install the 'openpyxl' package")
+
+        try:
+            try:
+                wb = load_workbook('%s.xlsx' % filepath, read_only=True,
+                                   data_only=self.data_only)
+            except TypeError:
+                # openpyxl before 2.0
+                wb = load_workbook('%s.xlsx' % filepath, use_iterators=True,
+                                   data_only=self.data_only)
+        except InvalidFileException:
+            print("Warning, the file in invalid")
+            return
+
+        try:
+            ws = self._get_worksheet(wb)
+            try:
+                rows = ws.iter_rows(values_only=True)
+            except TypeError:
+                # openpyxl before 2.6
+                rows = ([cell.value for cell in row]
+                        for row in ws.iter_rows())
+            try:
+                keys = next(rows)
+            except StopIteration:
+                return
+
+            wanted = None
+            if self.columns is not None:
+                wanted = set(self.columns)
+                wanted.add(cls.pk_field)
+            columns = [(position, key) for position, key in enumerate(keys)
+                       if key is not None and
+                       (wanted is None or key in wanted)]
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                element = {}
+                for position, key in columns:
+                    # the read-only rows end at their last value
+                    if position < len(row):
+                        element[key] = row[position]
+                    else:
+                        element[key] = None
+                yield element
+        finally:
+            if hasattr(wb, "close"):
+                wb.close()
+
     def write_elements(self, filepath, data):
-        wb = Workbook()
+        if not openpyxl_imported:
+            raise Exception("In order to use XLS sources you should install the 'openpyxl' package")
+
+        try:
+            wb = Workbook(write_only=True)
+        except TypeError:
+            # openpyxl before 2.0
+            wb = Workbook(optimized_write=True)
         dest_filename = '%s.xlsx' % filepath
-        ws = wb.worksheets[self.worksheet]
-        ws.title = "Ojota data"
+        title = "Ojota data"
+        if isinstance(self.worksheet, six.string_types):
+            title = self.worksheet
+        ws = wb.create_sheet(title=title)
 
-        keys = []
+        keys = _get_columns(data)
+        ws.append(keys)
         for element in data:
-            keys.extend(list(element.keys()))
-        keys = list(set(keys))
-        row = 1
-        for col_index, key in enumerate(keys, 1):
-            col = get_column_letter(col_index)
-            ws.cell('%s%s' % (col, row)).value = key
-
-        for row, element in enumerate(data, 2):
-            for col_index, key in enumerate(keys, 1):
-                col = get_column_letter(col_index)
-                ws.cell('%s%s' % (col, row)).value = element.get(key)
+            ws.append([element.get(key) for key in keys])
 
         wb.save(filename=dest_filename)
 
 
 class DSONSource(Source):
     """Source class for the data stored with JSON format"""
+    file_extension = "dson"
+
     def read_elements(self, cls, filepath):
         """Reads the elements form a DSON file. Returns a dictionary containing
         the read data.
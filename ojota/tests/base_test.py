@@ -1,12 +1,22 @@
 from __future__ import absolute_import
+import gc
+import json
 import os
+import shutil
+import tempfile
+import threading
 
-from unittest.case import TestCase
+from unittest.case import TestCase, skipUnless
 
 from ojota import Ojota, current_data_code
-from ojota.base import set_data_source, Relation
-from ojota.sources import Source, YAMLSource
-from ojota.cache import DummyCache, Cache
+from ojota.base import set_data_source, Relation, preload, \
+    get_current_data_code, OjotaSet
+from ojota.sources import Source, YAMLSource, JSONSource
+from ojota.cache import DummyCache, Cache, LRUCache, RecordMemcache, \
+    TieredCache
+from ojota.columns import numpy_imported
+from ojota.indexes import HashIndex, SortedIndex
+from ojota.tests.cache_test import FakeMemcacheClient
 
 
 class Person(Ojota):
@@ -239,6 +249,41 @@ class OjotaTest(TestCase):
         self.assertEqual(expected, elements)
         current_data_code("")
 
+    def test_read_all_single_lookup(self):
+        """Testing a cache hit is answered with a single cache lookup."""
+        class CountingCache(Cache):
+            lookups = 0
+
+            def get_or_miss(self, name):
+                self.lookups += 1
+                return Cache.get_or_miss(self, name)
+
+            def __contains__(self, name):
+                raise AssertionError("__contains__ should not be used")
+
+        class Person2(Person):
+            plural_name = "Persons"
+            cache = CountingCache()
+
+        elements = Person2._read_all_from_datasource()
+        Person2.cache.lookups = 0
+        self.assertIs(elements, Person2._read_all_from_datasource())
+        self.assertEqual(1, Person2.cache.lookups)
+
+    def test_one_cached_item(self):
+        """Testing one reads a single element from a record cache."""
+        client = FakeMemcacheClient()
+
+        class Person2(Person):
+            plural_name = "Persons"
+            cache = RecordMemcache(client=client)
+
+        Person2.all()
+        client.calls = 0
+        self.assertEqual("Ezequiel", Person2.one("1").name)
+        self.assertEqual(1, client.calls)
+        self.assertIsNone(Person2.one("9"))
+
     def test_read_item_from_datasource(self):
         """Testing read one element from datasource."""
         expected = {'1': {'name': 'Ezequiel', 'age': 25,
@@ -285,6 +330,720 @@ class OjotaTest(TestCase):
         self.assertEqual(expected['1'], elements)
 
 
+class OjotaSetTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        set_data_source(os.path.join(file_path, "data"))
+
+    def test_lazy(self):
+        """Testing the query plan only runs when the elements are needed."""
+        persons = Person.all().many(age=35).many(team_id="1")
+        self.assertIsNone(persons._result)
+        self.assertEqual(1, len(persons._filter_stages()))
+        self.assertEqual(['3'], [person.id for person in persons])
+        self.assertIsNotNone(persons._result)
+
+    def test_chained_slice(self):
+        """Testing slicing a chained query."""
+        persons = Person.many(sorted="id").many(age__gte=25)[1:]
+        self.assertEqual(['2', '3'], [person.id for person in persons])
+        persons = persons.many(team_id="1")
+        self.assertEqual(['3'], [person.id for person in persons])
+        self.assertEqual(['2'], [person.id for person in
+                                 Person.many(sorted="-id")[1:2]])
+
+    def test_chained_same_expression(self):
+        """Testing chaining filters on the same expression."""
+        persons = Person.many(age__gt=20).many(age__gt=30)
+        self.assertEqual(2, len(persons._filter_stages()))
+        self.assertEqual(['2', '3'], sorted(person.id for person in persons))
+
+    def test_chained_order(self):
+        """Testing ordering a chained query."""
+        persons = Person.many(sorted="id").many(sorted="-id", age=35)
+        self.assertEqual(['3', '2'], [person.id for person in persons])
+
+    def test_mutation(self):
+        """Testing mutating a set does not change the table."""
+        class Person2(Person):
+            plural_name = "Persons"
+            cache = Cache()
+
+        persons = Person2.all()
+        del persons[0]
+        self.assertEqual(2, len(persons))
+        self.assertEqual(3, len(Person2.all()))
+
+    def test_identity_map(self):
+        """Testing the identity map returns the same objects."""
+        class Person2(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            identity_map = True
+
+        persons = Person2.many(sorted="id")
+        self.assertIs(persons[0], persons[0])
+        self.assertIs(persons[0], list(persons)[0])
+        self.assertIs(persons[0], Person2.one('1'))
+        self.assertIs(persons[1], Person2.many(age=35, sorted="id")[0])
+
+        Person2.cache.clear(Person2.get_cache_name())
+        self.assertIsNot(persons[0], Person2.one('1'))
+        self.assertEqual(persons[0], Person2.one('1'))
+
+    def test_custom_queryset_type(self):
+        """Testing a queryset type built from the result of the query."""
+        class NamesSet(OjotaSet):
+            def __init__(self, ojota_class, data):
+                OjotaSet.__init__(self, ojota_class, data)
+                self.names = [element_data["name"] for element_data in data]
+
+        class Person2(Person):
+            plural_name = "Persons"
+            queryset_type = NamesSet
+
+        persons = Person2.many(age=35, sorted="-id")
+        self.assertEqual(["3", "2"], [person.id for person in persons])
+        self.assertEqual([person.name for person in persons], persons.names)
+        self.assertEqual(["2"], [person.id for person in persons[1:]])
+
+    def test_no_identity_map(self):
+        """Testing objects are built on every access without identity map.
+        """
+        persons = Person.many(sorted="id")
+        self.assertIsNot(persons[0], persons[0])
+
+
+class SchemaTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        set_data_source(os.path.join(file_path, "data"))
+
+        class SlottedPerson(Person):
+            plural_name = "Persons"
+            fields_schema = ("id", "name", "address", "age", "height",
+                             "team_id", "country_id")
+
+        self.SlottedPerson = SlottedPerson
+
+    def test_slots(self):
+        """Testing the slots are generated from the schema."""
+        self.assertEqual(self.SlottedPerson.fields_schema,
+                         self.SlottedPerson.__slots__)
+        self.assertEqual(("id", ), self.SlottedPerson.required_fields)
+
+    def test_to_dict(self):
+        """Testing to_dict with a schema."""
+        expected = {'name': 'Matias', 'age': 35, 'country_id': '1',
+                    'team_id': '2', 'address': 'Che Guevara 1875',
+                    'id': '2'}
+        person = self.SlottedPerson.one('2')
+        self.assertEqual(expected, person.to_dict())
+        self.assertFalse(hasattr(person, "height"))
+        self.assertEqual(sorted(expected), sorted(person.fields))
+
+    def test_from_element_data(self):
+        """Testing the generated constructor."""
+        data = {"id": "9", "name": "Juan", "nickname": "Juancho"}
+        person = self.SlottedPerson._from_element_data(data)
+        self.assertIsInstance(person, self.SlottedPerson)
+        self.assertEqual(data, person.to_dict())
+
+    def test_init_required(self):
+        """Testing required fields with a schema."""
+        self.assertRaises(AttributeError, self.SlottedPerson, name="Juan")
+        person = self.SlottedPerson(id="9", name="Juan")
+        self.assertEqual({"id": "9", "name": "Juan"}, person.to_dict())
+
+    def test_many(self):
+        """Testing queries with a schema."""
+        persons = self.SlottedPerson.many(age=35, sorted="id")
+        self.assertEqual(['2', '3'], [person.id for person in persons])
+        self.assertEqual(Person.one('2').to_dict(), persons[0].to_dict())
+
+
+class IndexTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        set_data_source(os.path.join(file_path, "data"))
+
+        class IndexedPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            indexed_fields = ("country_id", "team_id")
+
+        self.IndexedPerson = IndexedPerson
+
+    def test_evicted_tables_released(self):
+        """Testing the tables are released with their cached elements."""
+        class TenantPerson(self.IndexedPerson):
+            plural_name = "Persons"
+            data_in_root = False
+            cache = LRUCache(max_entries=1)
+
+        try:
+            TenantPerson.many(country_id="1")
+            self.assertEqual(["_cache_Persons"], list(TenantPerson._tables))
+            current_data_code("alternative")
+            TenantPerson.many(country_id="1")
+            self.assertEqual(["_cache_Persons_alternative"],
+                             list(TenantPerson._tables))
+        finally:
+            current_data_code("")
+
+        class BigPerson(self.IndexedPerson):
+            plural_name = "Persons"
+            cache = LRUCache(max_bytes=1)
+
+        BigPerson.many(country_id="1")
+        self.assertEqual({}, BigPerson._tables)
+
+    def test_uncached_tables_released(self):
+        """Testing no table is kept when the elements are not cached."""
+        class UncachedPerson(self.IndexedPerson):
+            plural_name = "Persons"
+            cache = DummyCache()
+
+        self.assertEqual(2, len(UncachedPerson.many(country_id="1")))
+        self.assertEqual({}, UncachedPerson._tables)
+        # the elements are read again for every query, so are not indexed
+        self.assertEqual({}, UncachedPerson._get_table().indexes)
+
+    def test_indexes_built(self):
+        """Testing the indexes are built when the cache is filled."""
+        self.IndexedPerson._read_all_from_datasource()
+        table = self.IndexedPerson._get_table()
+        self.assertEqual(["country_id", "team_id"], sorted(table.indexes))
+
+    def test_many_indexed(self):
+        """Testing many with indexed equality and exact lookups."""
+        for filters in ({"country_id": "1"}, {"country_id__exact": "1"}):
+            persons = self.IndexedPerson.many(**filters)
+            result = [person.primary_key for person in persons]
+            self.assertEqual(['1', '2'], result)
+
+    def test_many_indexed_in(self):
+        """Testing many with an indexed in lookup."""
+        persons = self.IndexedPerson.many(team_id__in=("2", "3"))
+        result = [person.primary_key for person in persons]
+        self.assertEqual(['2'], result)
+
+    def test_many_indexed_mixed(self):
+        """Testing many mixing indexed and not indexed filters."""
+        persons = self.IndexedPerson.many(country_id="1", team_id="1",
+                                          age__gt=20)
+        result = [person.primary_key for person in persons]
+        self.assertEqual(['1'], result)
+
+        persons = self.IndexedPerson.many(country_id="1", age__gt=30)
+        result = [person.primary_key for person in persons]
+        self.assertEqual(['2'], result)
+
+    def test_many_indexed_queryset(self):
+        """Testing OjotaSet.many with indexes."""
+        persons = self.IndexedPerson.many(age=35)
+        result = [person.primary_key for person in
+                  persons.many(team_id="1")]
+        self.assertEqual(['3'], result)
+
+    def test_index_matches_scan(self):
+        """Testing the indexed results match the ones without indexes."""
+        filters = [{"team_id": "1"}, {"country_id__in": ["0", "1"]},
+                   {"team_id__in": "12"}, {"country_id": "9"}]
+        for filter_ in filters:
+            expected = [person.primary_key for person in
+                        Person.many(**filter_)]
+            result = [person.primary_key for person in
+                      self.IndexedPerson.many(**filter_)]
+            self.assertEqual(expected, result)
+
+    def test_sorted_index_lookups(self):
+        """Testing range lookups with a sorted index."""
+        class SortedPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            indexed_fields = {"age": SortedIndex, "name": SortedIndex,
+                              "team_id": HashIndex}
+
+        filters = [{"age__gte": 35}, {"age__gt": 25}, {"age__lt": 35},
+                   {"age__lte": 25}, {"age__range": (20, 30)},
+                   {"age": 35, "team_id": "1"}, {"age__in": [25, 40]},
+                   {"name__startswith": "Ju"}, {"name__startswith": "X"}]
+        for filter_ in filters:
+            expected = [person.primary_key for person in
+                        Person.many(**filter_)]
+            result = [person.primary_key for person in
+                      SortedPerson.many(**filter_)]
+            self.assertEqual(expected, result)
+
+    def test_sorted_index_order(self):
+        """Testing the order is taken from a sorted index."""
+        class SortedPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            indexed_fields = {"age": SortedIndex, "name": SortedIndex}
+
+        for order in ("age", "-age", "-name"):
+            expected = [person.primary_key for person in
+                        Person.many(sorted=order)]
+            result = [person.primary_key for person in
+                      SortedPerson.many(sorted=order)]
+            self.assertEqual(expected, result)
+
+    def test_sorted_index_reverse_ties(self):
+        """Testing reversed index order keeps ties in their original order.
+        """
+        rows = [{"n": 2}, {"n": 1}, {"n": 2}, {"n": 1}]
+        index = SortedIndex("n", rows)
+        self.assertEqual([1, 3, 0, 2], index.ordered_positions())
+        self.assertEqual([0, 2, 1, 3], index.ordered_positions(True))
+
+    def test_sorted_index_not_comparable(self):
+        """Testing a sorted index with values that can not be ordered."""
+        index = SortedIndex("n", [{"n": 2}, {"n": "a"}, {}])
+        self.assertIsNone(index.lookup("gt", 1))
+        self.assertIsNone(index.ordered_positions())
+
+
+@skipUnless(numpy_imported, "numpy is not installed")
+class ColumnarTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        set_data_source(os.path.join(file_path, "data"))
+
+        class ColumnarPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            columnar = True
+
+        self.ColumnarPerson = ColumnarPerson
+
+    def test_columns(self):
+        """Testing the columns are built when the cache is filled."""
+        self.ColumnarPerson._read_all_from_datasource()
+        columns = self.ColumnarPerson._get_table().columns.columns
+        self.assertTrue(columns["age"].numeric)
+        self.assertTrue(columns["height"].numeric)
+        self.assertFalse(columns["name"].numeric)
+        self.assertEqual([True, False, False],
+                         columns["height"].present.tolist())
+
+    def test_masks_match_scan(self):
+        """Testing the vectorized filters match the ones row by row."""
+        filters = [{"age": 35}, {"age__gt": 25}, {"age__lte": 25},
+                   {"age__range": (30, 40)}, {"age__in": [25, 99]},
+                   {"age__ne": 25}, {"height__gte": 0}, {"height__ne": 1},
+                   {"name": "Matias"}, {"team_id__ne": "1", "age": 35},
+                   {"name__startswith": "Ju", "age__gte": 30},
+                   {"age": "35"}]
+        for filter_ in filters:
+            expected = [person.primary_key for person in
+                        Person.many(**filter_)]
+            result = [person.primary_key for person in
+                      self.ColumnarPerson.many(**filter_)]
+            self.assertEqual(expected, result)
+
+    def test_columnar_fields(self):
+        """Testing columnar storage for some of the fields."""
+        class ColumnarPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            columnar = ("age", )
+
+        ColumnarPerson._read_all_from_datasource()
+        columns = ColumnarPerson._get_table().columns.columns
+        self.assertEqual(["age"], list(columns))
+        persons = ColumnarPerson.many(age__gt=30, team_id="1")
+        self.assertEqual(['3'], [person.id for person in persons])
+
+
+class JournalTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        self.data_path = tempfile.mkdtemp()
+        shutil.copy(os.path.join(file_path, "data", "Persons.json"),
+                    self.data_path)
+
+        class JournalPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_source = JSONSource(self.data_path, journal=True)
+
+        self.JournalPerson = JournalPerson
+        self.json_path = os.path.join(self.data_path, "Persons.json")
+        self.journal_path = os.path.join(self.data_path, "Persons.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def _read_json(self):
+        json_file = open(self.json_path)
+        data = json.load(json_file)
+        json_file.close()
+        return sorted(element["id"] for element in data)
+
+    def test_journal(self):
+        """Testing changes are appended to the journal."""
+        self.JournalPerson(id="4", name="Pedro").save()
+        self.JournalPerson.one("1").update(name="Ezequiel Alvarez")
+        self.JournalPerson.one("2").delete()
+
+        self.assertEqual(['1', '2', '3'], self._read_json())
+        journal_file = open(self.journal_path)
+        self.assertEqual(3, len(journal_file.readlines()))
+        journal_file.close()
+
+        expected = ['1', '3', '4']
+        persons = self.JournalPerson.many(sorted="id")
+        self.assertEqual(expected, [person.id for person in persons])
+        self.assertEqual("Ezequiel Alvarez",
+                         self.JournalPerson.one("1").name)
+
+        # a class without the elements in cache replays the journal
+        class OtherPerson(self.JournalPerson):
+            cache = Cache()
+
+        persons = OtherPerson.many(sorted="id")
+        self.assertEqual(expected, [person.id for person in persons])
+        self.assertEqual("Ezequiel Alvarez", OtherPerson.one("1").name)
+
+    def test_compact(self):
+        """Testing the journal is folded into the data file."""
+        self.JournalPerson(id="4", name="Pedro").save()
+        self.JournalPerson.one("3").delete()
+        self.JournalPerson.compact()
+
+        self.assertFalse(os.path.exists(self.journal_path))
+        self.assertEqual(['1', '2', '4'], self._read_json())
+        persons = self.JournalPerson.many(sorted="id")
+        self.assertEqual(['1', '2', '4'], [person.id for person in persons])
+
+
+class WriteTestCase(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        self.data_path = tempfile.mkdtemp()
+        shutil.copy(os.path.join(file_path, "data", "Persons.json"),
+                    self.data_path)
+
+        class CountingSource(JSONSource):
+            saves = 0
+
+            def save(self, cls, data):
+                CountingSource.saves += 1
+                return JSONSource.save(self, cls, data)
+
+        class BulkPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_source = CountingSource(self.data_path)
+
+        self.BulkPerson = BulkPerson
+        self.CountingSource = CountingSource
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def _stored(self):
+        class StoredPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_source = JSONSource(self.data_path)
+
+        return StoredPerson._read_all_from_datasource()
+
+
+class BulkTest(WriteTestCase):
+    def test_bulk_create(self):
+        """Testing bulk_create saves once."""
+        persons = [self.BulkPerson(id=str(pk), name="Person %s" % pk)
+                   for pk in range(4, 54)]
+        self.BulkPerson.bulk_create(persons)
+        self.assertEqual(1, self.CountingSource.saves)
+        self.assertEqual(53, len(self._stored()))
+        self.assertEqual("Person 10", self.BulkPerson.one("10").name)
+
+    def test_bulk_update(self):
+        """Testing bulk_update only changes the given fields."""
+        persons = list(self.BulkPerson.many(sorted="id"))
+        for person in persons:
+            person.age = 50
+            person.name = "Not saved"
+        self.BulkPerson.bulk_update(persons, ["age"])
+        self.assertEqual(1, self.CountingSource.saves)
+
+        stored = self._stored()
+        self.assertEqual([50, 50, 50],
+                         [stored[pk]["age"] for pk in ('1', '2', '3')])
+        self.assertEqual("Matias", stored['2']["name"])
+
+    def test_bulk_delete(self):
+        """Testing bulk_delete saves once."""
+        self.BulkPerson.bulk_delete(['1', '3', '9'])
+        self.assertEqual(1, self.CountingSource.saves)
+        self.assertEqual(['2'], list(self._stored()))
+        self.assertEqual(['2'], [person.id for person in
+                                 self.BulkPerson.all()])
+
+    def test_save(self):
+        """Testing save, update and delete write the whole file."""
+        self.BulkPerson(id="4", name="Pedro").save()
+        self.BulkPerson.one("1").update(name="Ezequiel Alvarez")
+        self.BulkPerson.one("2").delete()
+        self.assertEqual(3, self.CountingSource.saves)
+
+        stored = self._stored()
+        self.assertEqual(['1', '3', '4'], sorted(stored))
+        self.assertEqual("Ezequiel Alvarez", stored['1']["name"])
+
+
+class TransactionTest(WriteTestCase):
+    def test_commit(self):
+        """Testing the changes are saved once when the block ends."""
+        with Ojota.transaction():
+            self.BulkPerson(id="4", name="Pedro").save()
+            self.BulkPerson.one("1").update(name="Ezequiel Alvarez")
+            self.BulkPerson.one("2").delete()
+            self.BulkPerson.bulk_delete(["3"])
+            self.assertEqual(0, self.CountingSource.saves)
+            self.assertEqual(['1', '4'], [person.id for person in
+                                          self.BulkPerson.many(sorted="id")])
+            self.assertEqual("Ezequiel Alvarez",
+                             self.BulkPerson.one("1").name)
+            self.assertEqual(['1', '2', '3'], sorted(self._stored()))
+
+        self.assertEqual(1, self.CountingSource.saves)
+        stored = self._stored()
+        self.assertEqual(['1', '4'], sorted(stored))
+        self.assertEqual("Ezequiel Alvarez", stored['1']["name"])
+        self.assertEqual(['1', '4'], [person.id for person in
+                                      self.BulkPerson.many(sorted="id")])
+
+    def test_rollback(self):
+        """Testing the changes are discarded when the block raises."""
+        def _change():
+            with self.BulkPerson.transaction():
+                self.BulkPerson(id="4", name="Pedro").save()
+                self.BulkPerson.one("1").delete()
+                raise ValueError
+
+        self.assertRaises(ValueError, _change)
+        self.assertEqual(0, self.CountingSource.saves)
+        self.assertEqual(['1', '2', '3'], sorted(self._stored()))
+        self.assertEqual(['1', '2', '3'], [person.id for person in
+                                           self.BulkPerson.many(sorted="id")])
+
+    def test_nested(self):
+        """Testing nested blocks join the outer transaction."""
+        with Ojota.transaction() as outer:
+            with Ojota.transaction() as inner:
+                self.assertIs(outer, inner)
+                self.BulkPerson(id="4", name="Pedro").save()
+            self.assertEqual(0, self.CountingSource.saves)
+        self.assertEqual(1, self.CountingSource.saves)
+
+
+class FreshnessTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        self.data_path = tempfile.mkdtemp()
+        shutil.copy(os.path.join(file_path, "data", "Persons.json"),
+                    self.data_path)
+        self.json_path = os.path.join(self.data_path, "Persons.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def _person_class(self, interval, journal=False):
+        class FreshPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_source = JSONSource(self.data_path, journal=journal)
+            freshness_interval = interval
+
+        return FreshPerson
+
+    def _replace_data(self):
+        json_file = open(self.json_path, "w")
+        json.dump([{"id": "9", "name": "New"}], json_file)
+        json_file.close()
+
+    def test_reload_changed(self):
+        """Testing the elements are read again when the file changes."""
+        FreshPerson = self._person_class(0)
+        self.assertEqual(3, len(FreshPerson.all()))
+        self._replace_data()
+        self.assertEqual(['9'], [person.id for person in FreshPerson.all()])
+
+    def test_throttled(self):
+        """Testing the file is not checked again before the interval."""
+        FreshPerson = self._person_class(60 * 1000)
+        self.assertEqual(3, len(FreshPerson.all()))
+        self._replace_data()
+        self.assertEqual(3, len(FreshPerson.all()))
+
+    def test_not_checked(self):
+        """Testing the file is never checked without an interval."""
+        FreshPerson = self._person_class(None)
+        self.assertEqual(3, len(FreshPerson.all()))
+        self._replace_data()
+        self.assertEqual(3, len(FreshPerson.all()))
+
+    def test_own_journal_changes(self):
+        """Testing our own journal changes do not read the file again."""
+        FreshPerson = self._person_class(0, journal=True)
+        elements = FreshPerson._read_all_from_datasource()
+        FreshPerson(id="4", name="Pedro").save()
+        self.assertIs(elements, FreshPerson._read_all_from_datasource())
+        self.assertEqual(4, len(FreshPerson.all()))
+
+
+class PreloadTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        set_data_source(os.path.join(file_path, "data"))
+
+        class PreloadPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_in_root = False
+            indexed_fields = ("id", )
+            identity_map = True
+
+        self.PreloadPerson = PreloadPerson
+
+    def tearDown(self):
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+        TestCase.tearDown(self)
+
+    def test_preload(self):
+        """Testing preload fills the cache."""
+        self.assertIsNone(preload(self.PreloadPerson))
+        self.assertIn("_cache_Persons", self.PreloadPerson.cache)
+
+    def test_preload_for_fork(self):
+        """Testing preload for fork builds the tables of every data code."""
+        report = preload(self.PreloadPerson, for_fork=True,
+                         data_codes=["", "alternative"])
+        self.assertEqual(["_cache_Persons", "_cache_Persons_alternative"],
+                         sorted(report))
+        self.assertTrue(all(size > 0 for size in report.values()))
+        self.assertEqual("", get_current_data_code())
+
+        current_data_code("alternative")
+        try:
+            table = self.PreloadPerson._get_table()
+            self.assertEqual(4, len(table.objects))
+            self.assertEqual(["id"], list(table.indexes))
+            self.assertIs(table.objects["1"], self.PreloadPerson.one("1"))
+        finally:
+            current_data_code("")
+
+        if hasattr(gc, "get_freeze_count"):
+            self.assertTrue(gc.get_freeze_count() > 0)
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        set_data_source(os.path.join(file_path, "data"))
+        self.release = threading.Event()
+        release = self.release
+
+        class SlowSource(JSONSource):
+            fetches = 0
+            error = None
+
+            def fetch_elements(self, cls):
+                SlowSource.fetches += 1
+                release.wait(5)
+                if self.error is not None:
+                    raise self.error
+                return JSONSource.fetch_elements(self, cls)
+
+        class SlowPerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_source = SlowSource()
+
+        self.SlowSource = SlowSource
+        self.SlowPerson = SlowPerson
+
+    def _read_concurrently(self):
+        results = []
+
+        def read():
+            try:
+                results.append(self.SlowPerson._read_all_from_datasource())
+            except Exception as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=read) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        while not self.SlowPerson._flights:
+            self.release.wait(0.01)
+        # let the other threads reach the flight before loading
+        self.release.wait(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_load(self):
+        """Testing concurrent reads load the elements once."""
+        results = self._read_concurrently()
+        self.assertEqual(1, self.SlowSource.fetches)
+        self.assertEqual(5, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual({}, self.SlowPerson._flights)
+
+    def test_error(self):
+        """Testing the error of the load is raised to every waiting caller.
+        """
+        self.SlowSource.error = ValueError("broken")
+        results = self._read_concurrently()
+        self.assertEqual(1, self.SlowSource.fetches)
+        self.assertTrue(all(isinstance(result, ValueError)
+                            for result in results))
+        self.assertNotIn("_cache_Persons", self.SlowPerson.cache)
+
+    def test_single_lookup(self):
+        """Testing an in-process cache is not looked up again on a miss."""
+        class LRUPerson(Person):
+            plural_name = "Persons"
+            cache = LRUCache()
+
+        LRUPerson._read_all_from_datasource()
+        self.assertEqual(1, LRUPerson.cache.stats()["misses"])
+
+        class SharedLRUCache(LRUCache):
+            shared = True
+
+        class SharedPerson(Person):
+            plural_name = "Persons"
+            cache = SharedLRUCache()
+
+        SharedPerson._read_all_from_datasource()
+        # looked up again under the lock, since another process may load it
+        self.assertEqual(2, SharedPerson.cache.stats()["misses"])
+        self.assertTrue(TieredCache(RecordMemcache(
+            client=FakeMemcacheClient())).shared)
+
+
 class ExpressionTest(TestCase):
     def _test_expression(self, expresion, value, element_data, should_return):
         result = Person._test_expression(expresion, value, element_data)
@@ -362,6 +1121,25 @@ class ExpressionTest(TestCase):
         self.assertRaises(AttributeError, Person._test_expression,
                           "name__blah", "uan", {"name": "juan"})
 
+    def test_filter(self):
+        """Testing filter with several expressions."""
+        data = [{'name': "juan", 'number': 5}, {'name': "Juana"},
+                {'name': "pedro", 'number': 7}]
+        filters = {"name__istartswith": "JUA", "number__gte": 5}
+        self.assertEqual([data[0]], Person._filter(data, filters))
+        self.assertEqual(data, Person._filter(data, {}))
+
+    def test_filter_plan_cache(self):
+        """Testing compiled filter plans are reused."""
+        from ojota.base import _get_filter_plan
+        plan = _get_filter_plan(("name__iexact", "number__lt"))
+        self.assertIs(plan, _get_filter_plan(("name__iexact", "number__lt")))
+
+    def test_filter_no_operation(self):
+        """Testing filter with an operation that does not exist."""
+        self.assertRaises(AttributeError, Person._filter, [],
+                          {"name__blah": "uan"})
+
 
 class RelationsTest(TestCase):
     def setUp(self):
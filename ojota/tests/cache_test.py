@@ -1,7 +1,53 @@
 from __future__ import absolute_import
+import os
+import shutil
+import tempfile
 from unittest.case import TestCase
 
-from ojota.cache import Cache, DummyCache
+from six.moves import cPickle as pickle
+
+from ojota.cache import Cache, DummyCache, LRUCache, Memcache, \
+    RecordMemcache, SharedMemoryCache, TieredCache, MISS, approximate_size
+
+
+class FakeMemcacheClient(object):
+    """In memory replacement of the memcache client."""
+    def __init__(self):
+        self.values = {}
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        return self.values.get(key)
+
+    def get_multi(self, keys):
+        self.calls += 1
+        return dict((key, self.values[key]) for key in keys
+                    if key in self.values)
+
+    def set(self, key, value, time=0):
+        self.calls += 1
+        self.values[key] = value
+
+    def add(self, key, value, time=0):
+        self.calls += 1
+        if key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    def set_multi(self, mapping, time=0):
+        self.calls += 1
+        self.values.update(mapping)
+
+    def delete(self, key):
+        self.calls += 1
+        self.values.pop(key, None)
+
+    def delete_multi(self, keys):
+        self.calls += 1
+        for key in keys:
+            self.values.pop(key, None)
 
 
 class CacheTest(TestCase):
@@ -37,6 +83,29 @@ class CacheTest(TestCase):
         cache.set(key, "")
         self.assertIn(key, cache)
 
+    def test_clear_inexistent(self):
+        """Testing clearing a name that is not cached."""
+        cache = Cache()
+        cache.clear("test")
+        self.assertNotIn("test", cache)
+
+    def test_get_or_miss(self):
+        """Testing get_or_miss."""
+        cache = Cache()
+        self.assertIs(MISS, cache.get_or_miss("test"))
+        cache.set("test", None)
+        self.assertIsNone(cache.get_or_miss("test"))
+
+    def test_items(self):
+        """Testing get_item_or_miss and set_item."""
+        cache = Cache()
+        cache.set_item("test", "1", "blah")
+        self.assertIs(MISS, cache.get_item_or_miss("test", "1"))
+        cache.set("test", {})
+        cache.set_item("test", "1", "blah")
+        self.assertEqual("blah", cache.get_item_or_miss("test", "1"))
+        self.assertIs(MISS, cache.get_item_or_miss("test", "2"))
+
 
 class DummyCacheTest(TestCase):
     def test_set_get(self):
@@ -70,3 +139,337 @@ class DummyCacheTest(TestCase):
         cache = DummyCache()
         cache.set(key, "")
         self.assertNotIn(key, cache)
+
+    def test_get_or_miss(self):
+        """Testing get_or_miss always misses."""
+        cache = DummyCache()
+        cache.set("test", "blah")
+        self.assertIs(MISS, cache.get_or_miss("test"))
+
+
+class MemcacheTest(TestCase):
+    def test_get_or_miss(self):
+        """Testing Memcache get_or_miss does a single round trip."""
+        client = FakeMemcacheClient()
+        cache = Memcache(client=client)
+        cache.set("test", {"1": {"id": "1"}})
+        client.calls = 0
+        self.assertEqual({"1": {"id": "1"}}, cache.get_or_miss("test"))
+        self.assertIs(MISS, cache.get_or_miss("other"))
+        self.assertEqual(2, client.calls)
+        self.assertRaises(AttributeError, cache.get, "other")
+        cache.clear("test")
+        self.assertNotIn("test", cache)
+
+    def test_compression(self):
+        """Testing the big values are compressed."""
+        client = FakeMemcacheClient()
+        cache = Memcache(client=client, compress_threshold=100)
+        small = {"1": {"id": "1"}}
+        big = dict((str(pk), {"id": str(pk), "name": "Ezequiel"})
+                   for pk in range(100))
+        cache.set("small", small)
+        cache.set("big", big)
+        self.assertTrue(client.values["small"].startswith(Memcache.MAGIC +
+                                                          b"P"))
+        self.assertTrue(client.values["big"].startswith(Memcache.MAGIC +
+                                                        b"Z"))
+        self.assertEqual(small, cache.get("small"))
+        self.assertEqual(big, cache.get("big"))
+
+    def test_chunks(self):
+        """Testing the values bigger than the chunk size are split."""
+        client = FakeMemcacheClient()
+        cache = Memcache(client=client, compress_threshold=None,
+                         chunk_size=100)
+        elements = dict((str(pk), {"id": str(pk)}) for pk in range(50))
+        cache.set("test", elements)
+        self.assertTrue(len(client.values) > 2)
+        self.assertEqual(elements, cache.get("test"))
+
+        # a lost chunk is a miss
+        chunk_key = [key for key in client.values if key != "test"][0]
+        client.values.pop(chunk_key)
+        self.assertIs(MISS, cache.get_or_miss("test"))
+        self.assertNotIn("test", cache)
+
+    def test_legacy_values(self):
+        """Testing the plain pickles of older versions are read."""
+        client = FakeMemcacheClient()
+        cache = Memcache(client=client)
+        client.set("test", pickle.dumps({"1": {"id": "1"}}))
+        self.assertEqual({"1": {"id": "1"}}, cache.get("test"))
+
+    def test_lock(self):
+        """Testing the Memcache lock."""
+        client = FakeMemcacheClient()
+        cache = Memcache(client=client, lock_timeout=0.1)
+        with cache.lock("test"):
+            self.assertIn("test:lock", client.values)
+            # a held lock is waited for until it times out
+            with cache.lock("test"):
+                pass
+            self.assertIn("test:lock", client.values)
+        self.assertNotIn("test:lock", client.values)
+
+
+class RecordMemcacheTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.client = FakeMemcacheClient()
+        self.cache = RecordMemcache(client=self.client)
+        self.elements = {"1": {"id": "1", "name": "Ezequiel"},
+                         "2": {"id": "2", "name": "Paul"}}
+
+    def test_set_get(self):
+        """Testing RecordMemcache stores a key per element."""
+        self.cache.set("test", self.elements)
+        # two elements, the manifest and the version
+        self.assertEqual(4, len(self.client.values))
+        self.assertEqual(self.elements, self.cache.get("test"))
+        self.assertIs(MISS, self.cache.get_or_miss("other"))
+
+    def test_get_item(self):
+        """Testing a single element is read with one round trip."""
+        self.cache.set("test", self.elements)
+        self.client.calls = 0
+        self.assertEqual(self.elements["2"],
+                         self.cache.get_item_or_miss("test", "2"))
+        self.assertIs(MISS, self.cache.get_item_or_miss("test", "3"))
+        self.assertEqual(2, self.client.calls)
+
+    def test_old_version(self):
+        """Testing the elements of an older version are ignored."""
+        self.cache.set("test", self.elements)
+        self.cache.set("test", {"1": self.elements["1"]})
+        self.assertIs(MISS, self.cache.get_item_or_miss("test", "2"))
+        self.assertEqual(["1"], list(self.cache.get("test")))
+
+        self.cache.clear("test")
+        self.assertIs(MISS, self.cache.get_item_or_miss("test", "1"))
+        self.assertIs(MISS, self.cache.get_or_miss("test"))
+
+    def test_evicted(self):
+        """Testing a table with evicted elements is a miss."""
+        self.cache.set("test", self.elements)
+        self.client.values.pop(self.cache._get_record_key("test", "1"))
+        self.assertIs(MISS, self.cache.get_or_miss("test"))
+
+    def test_set_item(self):
+        """Testing setting one element of a cached table."""
+        self.cache.set_item("test", "3", {"id": "3"})
+        self.assertIs(MISS, self.cache.get_item_or_miss("test", "3"))
+
+        self.cache.set("test", self.elements)
+        self.cache.set_item("test", "3", {"id": "3"})
+        self.assertEqual({"id": "3"},
+                         self.cache.get_item_or_miss("test", "3"))
+        self.assertEqual(["1", "2", "3"], sorted(self.cache.get("test")))
+
+
+class LRUCacheTest(TestCase):
+    def test_set_get(self):
+        """Testing LRUCache set and get."""
+        cache = LRUCache()
+        cache.set("test", "blah")
+        self.assertIn("test", cache)
+        self.assertEqual("blah", cache.get("test"))
+        self.assertRaises(AttributeError, cache.get, "other")
+        self.assertEqual(1, cache.stats()["hits"])
+        self.assertEqual(1, cache.stats()["misses"])
+
+    def test_get_or_miss(self):
+        """Testing get_or_miss counts a single lookup."""
+        cache = LRUCache()
+        cache.set("test", "blah")
+        self.assertEqual("blah", cache.get_or_miss("test"))
+        self.assertIs(MISS, cache.get_or_miss("other"))
+        self.assertEqual(1, cache.stats()["hits"])
+        self.assertEqual(1, cache.stats()["misses"])
+
+    def test_listeners(self):
+        """Testing the listeners are told about the dropped entries."""
+        cache = LRUCache(max_entries=1, max_bytes=10, sizeof=len)
+        dropped = []
+        cache.add_listener(dropped.append)
+        elems = "a"
+        cache.set("one", elems)
+        self.assertTrue(cache.holds("one", elems))
+        self.assertFalse(cache.holds("one", "a" * 2))
+        cache.set("two", "b")
+        cache.set("three", "c" * 20)
+        self.assertEqual(["one", "three"], dropped)
+
+    def test_max_entries(self):
+        """Testing the least recently used entry is evicted."""
+        cache = LRUCache(max_entries=2)
+        cache.set("one", 1)
+        cache.set("two", 2)
+        cache.get("one")
+        cache.set("three", 3)
+        self.assertIn("one", cache)
+        self.assertNotIn("two", cache)
+        self.assertIn("three", cache)
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_max_bytes(self):
+        """Testing entries are evicted to stay in the memory budget."""
+        cache = LRUCache(max_bytes=1000, sizeof=len)
+        cache.set("one", "a" * 600)
+        cache.set("two", "b" * 300)
+        self.assertEqual(900, cache.stats()["bytes"])
+        cache.set("three", "c" * 300)
+        self.assertNotIn("one", cache)
+        self.assertEqual(600, cache.stats()["bytes"])
+        cache.set("four", "d" * 2000)
+        self.assertNotIn("four", cache)
+        self.assertIn("three", cache)
+
+    def test_ttl(self):
+        """Testing entries expire."""
+        cache = LRUCache(ttl=60)
+        cache.set("one", 1)
+        cache.set("two", 2, ttl=-1)
+        self.assertIn("one", cache)
+        self.assertNotIn("two", cache)
+        self.assertEqual(1, cache.stats()["expirations"])
+
+    def test_clear(self):
+        """Testing clearing entries."""
+        cache = LRUCache(max_bytes=1000, sizeof=len)
+        cache.set("one", "a" * 10)
+        cache.clear("one")
+        cache.clear("two")
+        self.assertNotIn("one", cache)
+        self.assertEqual(0, cache.stats()["bytes"])
+
+    def test_approximate_size(self):
+        """Testing the approximate size of the cached elements."""
+        small = approximate_size({"1": {"name": "a"}})
+        big = approximate_size({"1": {"name": "a" * 1000}})
+        self.assertTrue(big - small >= 999)
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.client = FakeMemcacheClient()
+        self.cache = TieredCache(Memcache(client=self.client))
+        self.elements = {"1": {"id": "1", "name": "Ezequiel"}}
+
+    def test_set_get(self):
+        """Testing TieredCache only reads the generation from the L2."""
+        self.cache.set("test", self.elements)
+        self.client.calls = 0
+        elements = self.cache.get("test")
+        self.assertEqual(self.elements, elements)
+        self.assertIs(elements, self.cache.get("test"))
+        self.assertEqual(2, self.client.calls)
+        self.assertEqual(self.elements["1"],
+                         self.cache.get_item_or_miss("test", "1"))
+        self.assertIs(MISS, self.cache.get_or_miss("other"))
+        self.assertRaises(AttributeError, self.cache.get, "other")
+
+    def test_other_process(self):
+        """Testing a table set by another process is read again."""
+        other = TieredCache(Memcache(client=self.client))
+        self.cache.set("test", self.elements)
+        self.assertEqual(self.elements, other.get("test"))
+
+        other.set("test", {"2": {"id": "2"}})
+        self.assertEqual({"2": {"id": "2"}}, self.cache.get("test"))
+
+        other.set_item("test", "3", {"id": "3"})
+        self.assertEqual(["2", "3"], sorted(self.cache.get("test")))
+
+        other.clear("test")
+        self.assertNotIn("test", self.cache)
+        self.assertIs(MISS, self.cache.get_or_miss("test"))
+
+    def test_contains(self):
+        """Testing a cached table is found reading only the generation."""
+        self.cache.set("test", self.elements)
+        self.client.calls = 0
+        self.assertIn("test", self.cache)
+        self.assertEqual(1, self.client.calls)
+
+        self.client.calls = 0
+        self.cache.clear("test")
+        self.cache.clear("test")
+        self.assertEqual(4, self.client.calls)
+        self.assertNotIn("test", self.cache)
+
+    def test_record_l2(self):
+        """Testing the single elements are read from a record L2."""
+        cache = TieredCache(RecordMemcache(client=self.client))
+        cache.set("test", self.elements)
+        cache.l1.clear("test")
+        self.assertEqual(self.elements["1"],
+                         cache.get_item_or_miss("test", "1"))
+        self.assertIs(MISS, cache.get_item_or_miss("test", "2"))
+
+
+class SharedMemoryCacheTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        TestCase.tearDown(self)
+
+    def test_set_get(self):
+        """Testing SharedMemoryCache set and get."""
+        cache = SharedMemoryCache(self.path)
+        elements = {"1": {"id": "1", "name": "Ezequiel"}}
+        cache.set("_cache_Persons", elements)
+        self.assertIn("_cache_Persons", cache)
+        self.assertEqual(elements, cache.get("_cache_Persons"))
+        self.assertNotIn("other", cache)
+        self.assertRaises(AttributeError, cache.get, "other")
+        self.assertIs(MISS, cache.get_or_miss("other"))
+
+    def test_shared(self):
+        """Testing the data is shared between cache instances."""
+        writer = SharedMemoryCache(self.path)
+        reader = SharedMemoryCache(self.path)
+        writer.set("_cache_Persons", {"1": {"id": "1"}})
+        first = reader.get("_cache_Persons")
+        self.assertEqual({"1": {"id": "1"}}, first)
+        # the same version is only unpickled once
+        self.assertIs(first, reader.get("_cache_Persons"))
+
+        writer.set("_cache_Persons", {"2": {"id": "2"}})
+        self.assertEqual({"2": {"id": "2"}}, reader.get("_cache_Persons"))
+
+        writer.clear("_cache_Persons")
+        self.assertNotIn("_cache_Persons", reader)
+
+    def test_get_item(self):
+        """Testing a single element is read without reading the table."""
+        writer = SharedMemoryCache(self.path)
+        reader = SharedMemoryCache(self.path)
+        writer.set("_cache_Persons", {"1": {"id": "1"}, "2": {"id": "2"}})
+        self.assertEqual({"id": "2"},
+                         reader.get_item_or_miss("_cache_Persons", "2"))
+        self.assertIs(MISS, reader.get_item_or_miss("_cache_Persons", "3"))
+        self.assertNotIn("_cache_Persons", reader._loaded)
+        self.assertIs(MISS, reader.get_item_or_miss("other", "1"))
+
+        writer.set("_cache_Persons", {"2": {"id": "2", "name": "Matias"}})
+        self.assertEqual({"id": "2", "name": "Matias"},
+                         reader.get_item_or_miss("_cache_Persons", "2"))
+
+    def test_lock(self):
+        """Testing the SharedMemoryCache lock."""
+        cache = SharedMemoryCache(self.path)
+        with cache.lock("test"):
+            self.assertTrue(os.path.exists(cache._get_path("test") +
+                                           ".lock"))
+
+    def test_names(self):
+        """Testing names that are not valid file names."""
+        cache = SharedMemoryCache(self.path)
+        cache.set("a/b c", 1)
+        self.assertEqual(1, cache.get("a/b c"))
+        self.assertEqual(1, len(os.listdir(self.path)))
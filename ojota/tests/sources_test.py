@@ -1,11 +1,17 @@
 from __future__ import absolute_import
+import io
 import os
+import shutil
+import tempfile
+from datetime import date
 
-from unittest.case import TestCase
+from unittest.case import TestCase, skipUnless
 
 from ojota import Ojota
 from ojota.base import set_data_source, current_data_code
-from ojota.sources import Source, JSONSource, YAMLSource, DSONSource
+from ojota.cache import Cache, DummyCache
+from ojota.sources import Source, JSONSource, JSONLinesSource, YAMLSource, \
+    DSONSource, CSVSource, XLSSource, openpyxl_imported, _iter_json_array
 
 
 class SourceTest(TestCase):
@@ -101,6 +107,392 @@ class JsonSourceTest(TestCase):
         self.assertEqual(expected, result)
 
 
+class StreamingJsonSourceTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        file_path = (os.path.dirname(os.path.abspath(__file__)))
+        self.data_path = tempfile.mkdtemp()
+        shutil.copy(os.path.join(file_path, "data", "Persons.json"),
+                    self.data_path)
+
+        class Person(Ojota):
+            pk_field = "id"
+            cache = DummyCache()
+            data_source = JSONSource(self.data_path, streaming=True,
+                                     chunk_size=7)
+
+        self.Person = Person
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def test_read_elements(self):
+        """Testing the streaming element loading from JSON."""
+        source = self.Person.data_source
+        file_path = source._get_file_path(self.Person)
+        expected = JSONSource().read_elements(self.Person, file_path)
+        self.assertEqual(expected, source.read_elements(self.Person,
+                                                        file_path))
+
+    def test_many(self):
+        """Testing many streams the matching elements."""
+        self.assertTrue(self.Person._is_streaming())
+        persons = self.Person.many(age=35, sorted="-id")
+        self.assertEqual(["3", "2"], [person.id for person in persons])
+        self.assertEqual(["1"], [person.id for person in
+                                 self.Person.many(name__startswith="E")])
+        self.assertEqual("Matias", self.Person.one("2").name)
+
+    def test_empty(self):
+        """Testing a missing file is created empty."""
+        source = self.Person.data_source
+        self.assertEqual([], list(source.iter_elements(
+            self.Person, os.path.join(self.data_path, "Others"))))
+        self.assertTrue(os.path.exists(os.path.join(self.data_path,
+                                                    "Others.json")))
+
+    def test_parser(self):
+        """Testing the incremental parser."""
+        items = list(_iter_json_array(
+            io.StringIO(u' [ {"a": [1, 2]} , 12345,"x" ,\n[] ] '), 2))
+        self.assertEqual([{"a": [1, 2]}, 12345, "x", []], items)
+        self.assertEqual([], list(_iter_json_array(io.StringIO(u"[]"), 1)))
+        text = u'[1.5, 1e10 ,-2.25E-3,\n 12345 , 0.5e+2, {"a": 1.25}]'
+        for chunk_size in range(1, 8):
+            self.assertEqual([1.5, 1e10, -2.25e-3, 12345, 50.0, {"a": 1.25}],
+                             list(_iter_json_array(io.StringIO(text),
+                                                   chunk_size)))
+        for invalid in (u"[1, 2", u"{}", u"[1 2]", u"[{]"):
+            self.assertRaises(ValueError, list,
+                              _iter_json_array(io.StringIO(invalid), 3))
+
+
+class JSONLinesSourceTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.data_path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.data_path, "Persons.jsonl")
+        with open(self.file_path, "w") as data_file:
+            data_file.write('{"id": "1", "name": "Ezequiel", "age": 25}\n'
+                            '{"id": "2", "name": "Matias", "age": 35}\n'
+                            '{"id": "3", "name": "Juan Carlos", "age": 35}\n')
+
+        class CountingSource(JSONLinesSource):
+            scanned = 0
+
+            def _scan(self, *args, **kwargs):
+                CountingSource.scanned += 1
+                return JSONLinesSource._scan(self, *args, **kwargs)
+
+        class Person(Ojota):
+            pk_field = "id"
+            cache = DummyCache()
+            data_source = CountingSource(self.data_path)
+
+        self.Person = Person
+        self.CountingSource = CountingSource
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def _lines(self):
+        with open(self.file_path) as data_file:
+            return data_file.readlines()
+
+    def test_read_elements(self):
+        """Testing the element loading from JSON lines."""
+        source = self.Person.data_source
+        elements = source.read_elements(self.Person,
+                                        source._get_file_path(self.Person))
+        self.assertEqual(["1", "2", "3"], sorted(elements))
+        self.assertEqual("Matias", elements["2"]["name"])
+        self.assertTrue(os.path.exists(self.file_path + ".index"))
+
+    def test_one(self):
+        """Testing one reads a single line with the stored index."""
+        self.assertEqual("Matias", self.Person.one("2").name)
+        self.assertIsNone(self.Person.one("9"))
+        self.assertEqual(1, self.CountingSource.scanned)
+
+        # another process reads the index from the sidecar
+        self.Person.data_source = JSONLinesSource(self.data_path)
+        self.assertEqual("Juan Carlos", self.Person.one("3").name)
+
+    def test_many(self):
+        """Testing many streams the elements."""
+        self.assertTrue(self.Person._is_streaming())
+        self.assertEqual(["3", "2"], [person.id for person in
+                                      self.Person.many(age=35, sorted="-id")])
+
+    def test_appends(self):
+        """Testing the changes are appended to the file."""
+        self.Person(id="4", name="Pedro", age=40).save()
+        self.Person.one("1").delete()
+        person = self.Person.one("2")
+        person.name = "Mati"
+        person.save()
+        self.assertEqual(6, len(self._lines()))
+
+        self.assertIsNone(self.Person.one("1"))
+        self.assertEqual("Mati", self.Person.one("2").name)
+        self.assertEqual("Pedro", self.Person.one("4").name)
+        self.assertEqual(["2", "3", "4"],
+                         sorted(person.id for person in self.Person.all()))
+
+        self.Person.compact()
+        self.assertEqual(3, len(self._lines()))
+        self.assertEqual("Mati", self.Person.one("2").name)
+
+    def test_cut_line(self):
+        """Testing a line cut in the middle is ignored."""
+        with open(self.file_path, "a") as data_file:
+            data_file.write('{"id": "4", "na')
+        self.assertIsNone(self.Person.one("4"))
+        self.assertEqual(3, len(self.Person.all()))
+
+    def test_cached(self):
+        """Testing a cached class reads single elements from the file."""
+        class CachedPerson(self.Person):
+            plural_name = "Persons"
+            cache = Cache()
+
+        self.assertEqual(3, len(CachedPerson.all()))
+        self.assertEqual("Ezequiel", CachedPerson.one("1").name)
+
+    def test_cached_one(self):
+        """Testing one reads the cache and the identity map first."""
+        class MappedPerson(self.Person):
+            plural_name = "Persons"
+            cache = Cache()
+            identity_map = True
+
+        persons = MappedPerson.many(sorted="id")
+        self.assertIs(persons[1], MappedPerson.one("2"))
+
+        class CachedPerson(self.Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_source = JSONLinesSource(self.data_path)
+
+        self.assertEqual(3, len(CachedPerson.all()))
+        CachedPerson.data_source.fetch_element = None
+        self.assertEqual("Matias", CachedPerson.one("2").name)
+
+    def test_cached_prefilter(self):
+        """Testing the single reads do not put elements in the cache."""
+        class CachedPerson(self.Person):
+            plural_name = "Persons"
+            cache = Cache()
+            prefilter = {"age": 35}
+
+        elements = CachedPerson._read_all_from_datasource()
+        self.assertEqual(["2", "3"], sorted(elements))
+        self.assertIsNone(CachedPerson.one("1"))
+        self.assertEqual("Matias", CachedPerson.one("2").name)
+        cached = CachedPerson.cache.get(CachedPerson.get_cache_name())
+        self.assertIs(elements, cached)
+        self.assertEqual(["2", "3"], sorted(cached))
+
+    def test_stream_elements(self):
+        """Testing the elements are streamed without reading them all."""
+        source = self.Person.data_source
+        source.read_elements = None
+        self.assertEqual(["1", "2", "3"],
+                         [element["id"] for element in
+                          source.stream_elements(self.Person)])
+
+    def test_file_mode(self):
+        """Testing the rewritten file keeps its mode."""
+        os.chmod(self.file_path, 0o640)
+        self.Person.compact()
+        self.assertEqual(0o640, os.stat(self.file_path).st_mode & 0o777)
+        self.assertEqual(3, len(self._lines()))
+
+
+class CSVSourceTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.data_path = tempfile.mkdtemp()
+        with open(os.path.join(self.data_path, "Persons.csv"), "w") as data:
+            data.write('id,name,age,active,born\n'
+                       '1,"Ezequiel, Jr",25,yes,1990-05-01\n'
+                       '2,Matias,35,no,\n'
+                       '\n'
+                       '3,Juan Carlos,,true,1980-01-31\n')
+
+        class Person(Ojota):
+            pk_field = "id"
+            cache = DummyCache()
+            data_source = CSVSource(self.data_path, streaming=True,
+                                    types={"age": int, "active": bool,
+                                           "born": date})
+
+        self.Person = Person
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def test_read_elements(self):
+        """Testing the element loading from CSV."""
+        source = self.Person.data_source
+        result = source.read_elements(self.Person,
+                                      source._get_file_path(self.Person))
+        expected = {'1': {'id': '1', 'name': 'Ezequiel, Jr', 'age': 25,
+                          'active': True, 'born': date(1990, 5, 1)},
+                    '2': {'id': '2', 'name': 'Matias', 'age': 35,
+                          'active': False},
+                    '3': {'id': '3', 'name': 'Juan Carlos', 'active': True,
+                          'born': date(1980, 1, 31)}}
+        self.assertEqual(expected, result)
+
+    def test_untyped(self):
+        """Testing the columns without a type are kept as text."""
+        source = CSVSource(self.data_path)
+        result = source.read_elements(self.Person,
+                                      source._get_file_path(self.Person))
+        self.assertEqual("25", result["1"]["age"])
+
+    def test_many(self):
+        """Testing the filters compare the typed values."""
+        self.assertTrue(self.Person._is_streaming())
+        self.assertEqual(["2"], [person.id for person in
+                                 self.Person.many(age__gt=30)])
+        self.assertEqual(["3", "1"], [person.id for person in
+                                      self.Person.many(active=True,
+                                                       sorted="-id")])
+
+    def test_journal(self):
+        """Testing the typed values are kept in the journal."""
+        self.Person.data_source = CSVSource(
+            self.data_path, journal=True, types={"age": int, "born": date})
+        person = self.Person.one("2")
+        person.born = date(1985, 3, 2)
+        person.save()
+        self.Person(id="4", name="Pedro", born=date(2000, 1, 1)).save()
+
+        self.assertEqual(date(1985, 3, 2), self.Person.one("2").born)
+        self.assertEqual(date(2000, 1, 1), self.Person.one("4").born)
+        self.assertEqual(35, self.Person.one("2").age)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.data_path, "Persons.journal")))
+
+    def test_journal_compact(self):
+        """Testing the journal reads the same as the compacted file."""
+        class Person(Ojota):
+            pk_field = "id"
+            cache = Cache()
+            data_source = CSVSource(self.data_path, journal=True)
+
+        def ages():
+            return ([person.id for person in Person.many(age=40)],
+                    [person.id for person in Person.many(age="40")])
+
+        Person(id="2", name="Matias", age=40).save()
+        self.assertEqual(([], ["2"]), ages())
+        Person.cache.clear(Person.get_cache_name())
+        self.assertEqual(([], ["2"]), ages())
+        Person.compact()
+        self.assertEqual(([], ["2"]), ages())
+
+
+class WriteTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.data_path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.data_path, "Persons")
+        self.data = [{"id": "1", "name": "Ezequiel, Jr", "age": 25},
+                     {"id": "2", "team_id": "1"},
+                     {"name": "Matias", "id": "3"}]
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def test_csv(self):
+        """Testing the CSV writer keeps the order of the columns."""
+        source = CSVSource(self.data_path, types={"age": int})
+        source.write_elements(self.file_path, self.data)
+        with open(self.file_path + ".csv") as data_file:
+            lines = data_file.readlines()
+        self.assertEqual("id,name,age,team_id\n", lines[0])
+        self.assertEqual('1,"Ezequiel, Jr",25,\n', lines[1])
+
+        class Person(Ojota):
+            pk_field = "id"
+
+        elements = source.read_elements(Person, self.file_path)
+        self.assertEqual(dict((element["id"], element)
+                              for element in self.data), elements)
+
+    @skipUnless(openpyxl_imported, "openpyxl is not installed")
+    def test_xlsx(self):
+        """Testing the XLSX writer."""
+        from openpyxl import load_workbook
+        XLSSource(self.data_path).write_elements(self.file_path, self.data)
+        wb = load_workbook(self.file_path + ".xlsx")
+        rows = [[cell.value for cell in row] for row in wb.active.rows]
+        self.assertEqual([["id", "name", "age", "team_id"],
+                          ["1", "Ezequiel, Jr", 25, None],
+                          ["2", None, None, "1"],
+                          ["3", "Matias", None, None]], rows)
+        self.assertEqual("Ojota data", wb.active.title)
+
+
+@skipUnless(openpyxl_imported, "openpyxl is not installed")
+class XLSSourceTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.data_path = tempfile.mkdtemp()
+        data = [{"id": "1", "name": "Ezequiel", "age": 25},
+                {"id": "2", "name": "Matias", "age": 35}]
+        XLSSource(self.data_path, worksheet="People").write_elements(
+            os.path.join(self.data_path, "Persons"), data)
+
+        class Person(Ojota):
+            pk_field = "id"
+            cache = DummyCache()
+            data_source = XLSSource(self.data_path, worksheet="People",
+                                    streaming=True)
+
+        self.Person = Person
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def test_read_elements(self):
+        """Testing the element loading from XLSX."""
+        source = self.Person.data_source
+        result = source.read_elements(self.Person,
+                                      source._get_file_path(self.Person))
+        self.assertEqual({"1": {"id": "1", "name": "Ezequiel", "age": 25},
+                          "2": {"id": "2", "name": "Matias", "age": 35}},
+                         result)
+        self.assertEqual(["2"], [person.id for person in
+                                 self.Person.many(age__gt=30)])
+
+    def test_columns(self):
+        """Testing the column projection keeps the primary key."""
+        source = XLSSource(self.data_path, columns=["age"])
+        result = source.read_elements(self.Person,
+                                      source._get_file_path(self.Person))
+        self.assertEqual({"1": {"id": "1", "age": 25},
+                          "2": {"id": "2", "age": 35}}, result)
+
+    def test_round_trip(self):
+        """Testing the formulas and the trailing empty cells are kept."""
+        source = XLSSource(self.data_path)
+        file_path = source._get_file_path(self.Person)
+        source.write_elements(file_path, [{"id": "1", "f": "=A1", "n": "a"},
+                                          {"id": "2", "f": "x"}])
+        result = source.read_elements(self.Person, file_path)
+        self.assertEqual({"1": {"id": "1", "f": "=A1", "n": "a"},
+                          "2": {"id": "2", "f": "x", "n": None}}, result)
+
+
 class DsonSourceTest(TestCase):
     def test_read_elements(self):
         """Testing the element loading from JSON."""
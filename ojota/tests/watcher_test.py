@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from unittest.case import TestCase, skipUnless
+
+from ojota import Ojota, current_data_code
+from ojota.cache import Cache
+from ojota.sources import JSONSource
+from ojota.watcher import Reloader, inotify_imported
+
+
+@skipUnless(inotify_imported, "inotify is not available")
+class ReloaderTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.data_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.data_path, "alternative"))
+        self._write("Persons.json", [{"id": "1", "name": "Jhon"}])
+        self._write(os.path.join("alternative", "Persons.json"),
+                    [{"id": "1", "name": "Paul"}])
+
+        class Person(Ojota):
+            pk_field = "id"
+            cache = Cache()
+            data_source = JSONSource(self.data_path)
+
+        class CodePerson(Person):
+            plural_name = "Persons"
+            cache = Cache()
+            data_in_root = False
+
+        self.Person = Person
+        self.CodePerson = CodePerson
+        self.reloader = Reloader([Person, CodePerson], poll_timeout=0.1)
+
+    def tearDown(self):
+        self.reloader.stop()
+        current_data_code("")
+        shutil.rmtree(self.data_path)
+        TestCase.tearDown(self)
+
+    def _write(self, name, data):
+        # write and move into place, like the data drops do
+        path = os.path.join(self.data_path, name)
+        json_file = open(path + ".tmp", "w")
+        json.dump(data, json_file)
+        json_file.close()
+        os.rename(path + ".tmp", path)
+
+    def _wait_for(self, cls, name, data_code=""):
+        current_data_code(data_code)
+        cache_name = cls.get_cache_name()
+        current_data_code("")
+        for attempt in range(50):
+            if cache_name in cls.cache and \
+                    cls.cache.get(cache_name)["1"]["name"] == name:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_reload(self):
+        """Testing a changed file is reloaded into the cache."""
+        self.assertEqual("Jhon", self.Person.one("1").name)
+        self.reloader.start()
+        self._write("Persons.json", [{"id": "1", "name": "George"}])
+        self.assertTrue(self._wait_for(self.Person, "George"))
+        self.assertEqual("George", self.Person.one("1").name)
+
+    def test_reload_data_code(self):
+        """Testing files in the data code directories are reloaded."""
+        self.reloader.start()
+        self._write(os.path.join("alternative", "Persons.json"),
+                    [{"id": "1", "name": "Ringo"}])
+        self.assertTrue(self._wait_for(self.CodePerson, "Ringo",
+                                       "alternative"))
+        current_data_code("alternative")
+        self.assertEqual("Ringo", self.CodePerson.one("1").name)
+
+    def test_invalid_file(self):
+        """Testing an invalid file keeps the cached elements."""
+        self.assertEqual("Jhon", self.Person.one("1").name)
+        self.reloader.start()
+        json_file = open(os.path.join(self.data_path, "Persons.json"), "w")
+        json_file.write("[{")
+        json_file.close()
+        time.sleep(0.3)
+        self.assertEqual("Jhon", self.Person.one("1").name)
@@ -0,0 +1,177 @@
+"""
+This file is part of Ojota.
+
+    Ojota is free software: you can redistribute it and/or modify
+    it under the terms of the GNU LESSER GENERAL PUBLIC LICENSE as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Ojota is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU  Lesser General Public License
+    along with Ojota.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import absolute_import
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+from threading import Event, Thread
+
+from ojota.base import current_data_code, get_current_data_code
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                        use_errno=True)
+    inotify_imported = hasattr(_libc, "inotify_init")
+except OSError:
+    inotify_imported = False
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+_EVENT = struct.Struct("iIII")
+
+logger = logging.getLogger(__name__)
+
+
+class Reloader(object):
+    """Watches the data files of Ojota classes with Linux inotify from a
+    background thread. When a file is written or moved into place it is read
+    in that thread and the new elements replace the cached ones, so the
+    requests never pay for reading it.
+    """
+    def __init__(self, classes, data_codes=None, poll_timeout=0.5):
+        """Constructor for the Reloader class.
+
+        Arguments:
+            classes -- the Ojota classes to watch.
+            data_codes -- the data codes to watch for the classes with the
+            data not in the root. Defaults to every subdirectory of their
+            data path.
+            poll_timeout -- seconds between checks for stop().
+        """
+        if not inotify_imported:
+            raise Exception("The Reloader needs Linux inotify")
+
+        self.classes = classes
+        self.data_codes = data_codes
+        self.poll_timeout = poll_timeout
+        self._targets = {}
+        self._watches = {}
+        self._fd = None
+        self._thread = None
+        self._stop = Event()
+
+    def _get_data_codes(self, cls):
+        if cls.data_in_root:
+            return [""]
+        if self.data_codes is not None:
+            return list(self.data_codes)
+
+        current_data_code("")
+        root = os.path.dirname(cls.data_source._get_file_path(cls))
+        try:
+            names = os.listdir(root or ".")
+        except OSError:
+            names = []
+        return [name for name in names
+                if os.path.isdir(os.path.join(root, name))]
+
+    def _add_targets(self):
+        """Maps the files of every class and data code to them."""
+        previous_data_code = get_current_data_code()
+        for cls in self.classes:
+            for data_code in self._get_data_codes(cls):
+                current_data_code(data_code)
+                source = cls.data_source
+                if source.file_extension is None:
+                    continue
+                filepath = source._get_file_path(cls)
+                paths = ['%s.%s' % (filepath, source.file_extension)]
+                if source.journal:
+                    paths.append(source._get_journal_path(filepath))
+                for path in paths:
+                    path = os.path.abspath(path)
+                    targets = self._targets.setdefault(path, [])
+                    targets.append((cls, data_code))
+        current_data_code(previous_data_code)
+
+    def _add_watches(self):
+        directories = set(os.path.dirname(path) for path in self._targets)
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO
+        for directory in directories:
+            wd = _libc.inotify_add_watch(self._fd,
+                                         directory.encode("utf-8"), mask)
+            if wd < 0:
+                logger.warning("Can not watch %s: %s", directory,
+                               os.strerror(ctypes.get_errno()))
+            else:
+                self._watches[wd] = directory
+
+    def start(self):
+        """Starts watching in a daemon thread."""
+        self._fd = _libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self._add_targets()
+        self._add_watches()
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="ojota-reloader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching and waits for the thread to end."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._watches = {}
+        self._targets = {}
+
+    def _read_events(self):
+        """Returns the set of paths with events since the last read."""
+        data = os.read(self._fd, 64 * 1024)
+        paths = set()
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            directory = self._watches.get(wd)
+            if directory is not None and name:
+                paths.add(os.path.join(directory, name.decode("utf-8")))
+        return paths
+
+    def _run(self):
+        while not self._stop.is_set():
+            ready = select.select([self._fd], [], [], self.poll_timeout)[0]
+            if ready:
+                for path in self._read_events():
+                    self.reload_path(path)
+
+    def reload_path(self, path):
+        """Reloads the elements of every class and data code stored in a
+        file.
+
+        Arguments:
+            path -- the absolute path of the file that changed.
+        """
+        for cls, data_code in self._targets.get(path, ()):
+            current_data_code(data_code)
+            try:
+                cls.reload()
+            except Exception:
+                # keep serving the elements we have
+                logger.exception("Can not reload %s", path)
+        current_data_code("")